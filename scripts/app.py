@@ -1,13 +1,39 @@
+import hashlib
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import dash
-from dash import dcc, html, ctx, dash_table
-from dash.dependencies import Input, Output, State
+from dash import dcc, html, ctx, dash_table, no_update
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from dateutil.relativedelta import relativedelta
 
-def render_chart_tab():
+from trading_calendar import TradingCalendar
+from chart_data import CHART_FILE, CHART_INDEX_FILE, DAILY_FILE, load_chart_data
+from chart_detail import DETAIL_LEVELS, HALF_BAR_DAYS, detail_level, detail_window, level_series
+from signal_events import EVENTS_FILE, load_events
+from summary_snapshots import SNAPSHOT_FILE, SNAPSHOT_INDEX_FILE, load_snapshots
+
+SUMMARY_PAGE_SIZE = 20
+
+# seconds between checks of data/processed for a new build, and between an
+# open page's checks for a newer data version than the one it shows
+RELOAD_INTERVAL = 5
+PAGE_REFRESH_INTERVAL = 30
+WATCHED_FILES = [CHART_FILE, CHART_INDEX_FILE, SNAPSHOT_FILE, SNAPSHOT_INDEX_FILE, EVENTS_FILE, DAILY_FILE]
+
+# figures kept (one per stock, level of detail and window)
+FIGURE_CACHE_SIZE = 32
+# signal markers: offset above the bar's high and gap between stacked markers, as a fraction of the high
+MARKER_OFFSET = 0.01
+MARKER_GAP = 0.015
+
+def render_chart_tab(data):
     return html.Div([
 
         html.Div([
@@ -16,7 +42,7 @@ def render_chart_tab():
                     html.Button("◀", id="btn-prev-stock", n_clicks=0, className="stock-nav-btn"),
                     dcc.Dropdown(
                         id="stock-dropdown",
-                        options=stock_options,
+                        options=data.stock_options,
                         value="2330",
                         clearable=False,
                         style={"width": "360px"}
@@ -99,9 +125,10 @@ def render_chart_tab():
 
     ])
 
-def render_summary_tab():
+def render_summary_tab(data):
 
-    available_dates = sorted(df['date'].unique(), reverse=True)
+    available_dates = data.summary_dates()
+    first_page, page_count = data.snapshots.page(available_dates[0], 0, SUMMARY_PAGE_SIZE)
 
     return html.Div(
 
@@ -112,7 +139,7 @@ def render_summary_tab():
                 html.Label("選擇交易日：", style={"marginRight": "10px"}),
                 dcc.Dropdown(
                     id="summary-date-dropdown",
-                    options=[{'label': d.strftime('%Y-%m-%d'), 'value': d} for d in available_dates],
+                    options=date_options(available_dates),
                     value=available_dates[0],
                     clearable=False,
                     style={"width": "200px"}
@@ -132,7 +159,8 @@ def render_summary_tab():
 
             dash_table.DataTable(
                 id="summary-table",
-                data=summary_df.to_dict("records"),
+                data=first_page,
+                page_count=page_count,
                 columns=[
                     {"name": "代碼", "id": "stock_id"},
                     {"name": "名稱", "id": "stock_name"},
@@ -146,13 +174,13 @@ def render_summary_tab():
                     {"name": "K", "id": "K"},
                     {"name": "DIF", "id": "DIF"},
                 ],
-                sort_action="native",
+                sort_action="custom",
                 sort_by=[],
-                filter_action="native",
+                filter_action="custom",
                 filter_query="",
-                page_action="native",
+                page_action="custom",
                 page_current=0,
-                page_size=20,
+                page_size=SUMMARY_PAGE_SIZE,
                 cell_selectable=True,
                 style_table={"overflowX": "auto"},
                 style_cell={
@@ -183,79 +211,240 @@ def render_summary_tab():
         ]
     )
 
-# load data
-df = pd.read_parquet('data/processed/daily.parquet')
-df['date'] = pd.to_datetime(df['date'])
-df = df.sort_values(["stock_id", "date"])
+def date_options(dates):
+    return [{'label': d.strftime('%Y-%m-%d'), 'value': d} for d in dates]
 
-latest_date = df['date'].max()
-summary_df = df[df['date'] == latest_date]
+
+# =========================
+# Data
+# =========================
+def files_signature():
+    """(mtime, size) of every file the app reads; changes when a build replaces them."""
+    signature = []
+    for path in WATCHED_FILES:
+        try:
+            stat = path.stat()
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+class DashboardData:
+    """One build of data/processed and everything the callbacks derive from it.
+
+    Callbacks read `dataset.current` once and use only that object, so a
+    request that is running when a new build is swapped in finishes on the
+    build it started with (the memory-mapped files it reads stay valid after
+    build_table replaces them). Figure and snapshot caches belong to the
+    build and are dropped with it.
+    """
+
+    def __init__(self, signature):
+        # only the built indexes are read here; chart columns are
+        # memory-mapped and paged in as stocks are drawn
+        self.signature = signature
+        self.version = hashlib.sha256(repr(signature).encode()).hexdigest()[:16]
+        self.charts = load_chart_data(DAILY_FILE)
+        self.events = load_events(DAILY_FILE)
+        self.snapshots = load_snapshots(DAILY_FILE)
+
+        self.stock_id_list = self.charts.stock_ids.tolist()
+        self.stock_position = self.charts.position
+        self.stock_options = [
+            {'label': f"{stock_id} - {name}", 'value': stock_id}
+            for stock_id, name in zip(self.stock_id_list, self.charts.stock_names.tolist())
+        ]
+        # what the clientside range callbacks need
+        self.date_bounds = {
+            "bounds": self.charts.bounds_seconds(),
+            "marker_room": 1 + MARKER_OFFSET + MARKER_GAP,
+            "detail_levels": DETAIL_LEVELS,
+        }
+
+        # trading days seen in the data also count, in case the calendar file is stale
+        self.calendar = TradingCalendar()
+        for d in pd.DatetimeIndex(self.charts.dates).strftime('%Y%m%d'):
+            self.calendar.mark_trading(d)
+        self.trading_days = self.calendar.trading_days()
+
+        self.figure = lru_cache(maxsize=FIGURE_CACHE_SIZE)(lambda *key: stock_figure(self, *key))
+
+    def summary_dates(self):
+        """Dates of the summary table, newest first."""
+        return [pd.Timestamp(d) for d in self.snapshots.dates[::-1]]
+
+class DataHandle:
+    """The current DashboardData, replaced in the background when a new build lands.
+
+    A build replaces several files one after another, so a new signature is
+    loaded only once it has stayed the same for a whole RELOAD_INTERVAL. The
+    swap is a single assignment; a build that fails to load is reported and
+    the previous one keeps serving.
+    """
+
+    def __init__(self):
+        self.current = DashboardData(files_signature())
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, args=(interval,), name="data-watcher", daemon=True)
+                self._watcher.start()
+
+    def _watch(self, interval):
+        seen = self.current.signature
+        while True:
+            time.sleep(interval)
+            seen = self.check(seen)
+
+    def check(self, seen):
+        """Load the files if they changed and match `seen`, the previous check's signature; returns this check's."""
+        signature = files_signature()
+        if signature == self.current.signature or signature != seen:
+            return signature
+        try:
+            data = DashboardData(signature)
+        except Exception as e:
+            print(f"Keeping data version {self.current.version}, new build failed to load ({e!r})")
+            return signature
+        self.current = data
+        print(f"Loaded data version {data.version}")
+        return signature
+
+dataset = DataHandle()
 
 # Dash app
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
+# WSGI entry point: gunicorn --pythonpath scripts --workers 4 app:server
+server = app.server
+
+# the watcher runs in the processes that serve requests, not in a debug
+# reloader's parent
+@app.server.before_request
+def start_data_watcher():
+    dataset.watch()
+
+# rendered per page load, from the data version current at the time
+def serve_layout():
+    data = dataset.current
+    return html.Div([
 
-# define stock options
-stock_options = []
-unique_stocks = df[['stock_id', 'stock_name']].drop_duplicates()
-for _, row in unique_stocks.iterrows():
-    stock_options.append({'label': f"{row['stock_id']} - {row['stock_name']}", 'value': row['stock_id']})
+        dcc.Store(
+            id="summary-clicked-stock",
+            storage_type="memory"
+        ),
+
+        # sent once per data version: what the clientside range callbacks need
+        dcc.Store(
+            id="stock-date-bounds",
+            storage_type="memory",
+            data=data.date_bounds
+        ),
 
-stock_id_list = [opt["value"] for opt in stock_options]
+        dcc.Store(id="data-version", storage_type="memory", data=data.version),
+        dcc.Interval(id="data-refresh", interval=PAGE_REFRESH_INTERVAL * 1000),
 
-app.layout = html.Div([
+        # set by set_range when the visible range needs a figure at another level of detail
+        dcc.Store(id="chart-request", storage_type="memory"),
 
-    dcc.Store(
-        id="summary-clicked-stock",
-        storage_type="memory"
-    ),
+        html.Div([
+            html.H1("Dashboard", style={'textAlign': 'center', 'margin': '0', 'padding': '20px 0'}),
+
+            dcc.Tabs(
+                id="tabs",
+                value="tab-table",
+                parent_className="custom-tabs-container",
+                className="custom-tabs",
+                children=[
+                    dcc.Tab(
+                        label="Summary Table",
+                        value="tab-table",
+                        className="custom-tab",
+                        selected_className="custom-tab--selected"
+                    ),
+                    dcc.Tab(
+                        label="Chart",
+                        value="tab-chart",
+                        className="custom-tab",
+                        selected_className="custom-tab--selected"
+                    ),
+                ],
+                style={
+                    'height': '44px',
+                    'display': 'flex',
+                    'justifyContent': 'flex-start'
+                }
+            ),
 
-    html.Div([
-        html.H1("Dashboard", style={'textAlign': 'center', 'margin': '0', 'padding': '20px 0'}),
+        ], className="top-section"),
 
-        dcc.Tabs(
-            id="tabs",
-            value="tab-table",
-            parent_className="custom-tabs-container",
-            className="custom-tabs",
+        html.Div(
+            id="tab-content",
             children=[
-                dcc.Tab(
-                    label="Summary Table",
-                    value="tab-table",
-                    className="custom-tab",
-                    selected_className="custom-tab--selected"
-                ),
-                dcc.Tab(
-                    label="Chart",
-                    value="tab-chart",
-                    className="custom-tab",
-                    selected_className="custom-tab--selected"
-                ),
-            ],
-            style={
-                'height': '44px',
-                'display': 'flex',
-                'justifyContent': 'flex-start'
-            }
-        ),
+                html.Div(render_summary_tab(data), id="tab-table-div", style={"display": "none"}),
+                html.Div(render_chart_tab(data), id="tab-chart-div", style={"display": "block"}),
+            ]
+        )
+    ])
 
-    ], className="top-section"),
+app.layout = serve_layout
 
-    html.Div(
-        id="tab-content",
-        children=[
-            html.Div(render_summary_tab(), id="tab-table-div", style={"display": "none"}),
-            html.Div(render_chart_tab(), id="tab-chart-div", style={"display": "block"}),
-        ]
-    )
-])
+# an open page picks up a new data version: stock and date choices, the
+# clientside date bounds, and (through data-version) the table and chart
+@app.callback(
+    [
+        Output("data-version", "data"),
+        Output("stock-dropdown", "options"),
+        Output("stock-date-bounds", "data"),
+        Output("summary-date-dropdown", "options"),
+        Output("summary-date-dropdown", "value"),
+    ],
+    Input("data-refresh", "n_intervals"),
+    [
+        State("data-version", "data"),
+        State("summary-date-dropdown", "options"),
+        State("summary-date-dropdown", "value"),
+    ],
+    prevent_initial_call=True
+)
+def refresh_data(n_intervals, page_version, page_dates, selected_date):
+    data = dataset.current
+    if data.version == page_version:
+        raise PreventUpdate
+
+    dates = data.summary_dates()
+    # a page showing its newest date moves on to the new newest date
+    selected = pd.Timestamp(selected_date) if selected_date else None
+    if selected not in dates or (page_dates and selected == pd.Timestamp(page_dates[0]["value"])):
+        selected = dates[0]
+    return data.version, data.stock_options, data.date_bounds, date_options(dates), selected
 
+# the summary table is paged, sorted and filtered here; only one page is sent.
+# A filter or sort that leaves fewer pages moves page_current to the last one.
 @app.callback(
-    Output("summary-table", "data"),
-    Input("summary-date-dropdown", "value")
+    [
+        Output("summary-table", "data"),
+        Output("summary-table", "page_count"),
+        Output("summary-table", "page_current"),
+    ],
+    [
+        Input("summary-date-dropdown", "value"),
+        Input("summary-table", "page_current"),
+        Input("summary-table", "page_size"),
+        Input("summary-table", "sort_by"),
+        Input("summary-table", "filter_query"),
+        Input("data-version", "data"),
+    ]
 )
-def update_summary_table_by_date(selected_date):
-    filtered_df = df[df['date'] == selected_date]
-    return filtered_df.to_dict("records")
+def update_summary_table(selected_date, page_current, page_size, sort_by, filter_query, version):
+    try:
+        records, page_count = dataset.current.snapshots.page(selected_date, page_current, page_size, sort_by, filter_query)
+    except KeyError:
+        raise PreventUpdate
+    clamped = min(page_current or 0, page_count - 1)
+    return records, page_count, clamped if clamped != page_current else no_update
 
 @app.callback(
     [
@@ -289,7 +478,7 @@ def toggle_reset_button(filter_query, sort_by):
     [
         Output("summary-table", "filter_query"),
         Output("summary-table", "sort_by"),
-        Output("summary-table", "page_current"),
+        Output("summary-table", "page_current", allow_duplicate=True),
     ],
     Input("summary-reset-btn", "n_clicks"),
     prevent_initial_call=True
@@ -298,21 +487,12 @@ def reset_summary_table(n):
     return "", [], 0
 
 
-@app.callback(
-    [Output('date-slider-top', 'min'), Output('date-slider-top', 'max'), Output('date-slider-top', 'value'), Output('date-slider-top', 'marks'),
-     Output('date-slider-bottom', 'min'), Output('date-slider-bottom', 'max'), Output('date-slider-bottom', 'value'), Output('date-slider-bottom', 'marks')],
-    [Input('stock-dropdown', 'value')],
-    [dash.dependencies.State('date-slider-top', 'value')]
-)
-def update_slider_range(selected_stock, current_range):
-    stock_data = df[df['stock_id'] == selected_stock]
-    dates = pd.to_datetime(stock_data['date']).sort_values()
+def slider_range(data, selected_stock, current_range):
+    """Slider min, max, value and marks for a stock, keeping the current range where it fits."""
+    min_date, max_date = data.charts.date_bounds(selected_stock)
 
-    min_date = dates.min()
-    max_date = dates.max()
-
-    min_ts = int(dates.min().timestamp())
-    max_ts = int(dates.max().timestamp())
+    min_ts = int(min_date.timestamp())
+    max_ts = int(max_date.timestamp())
 
     one_month_ago_ts = int((max_date - relativedelta(months=1)).timestamp())
     default_start_ts = max(min_ts, one_month_ago_ts)
@@ -330,7 +510,7 @@ def update_slider_range(selected_stock, current_range):
     else:
         target_value = [default_start_ts, max_ts]
     
-    mark_dates = pd.date_range(start=dates.min(), end=dates.max(), periods=15)
+    mark_dates = pd.date_range(start=min_date, end=max_date, periods=15)
     marks = {
         int(d.timestamp()): {
             'label': d.strftime('%Y/%m'),
@@ -341,7 +521,7 @@ def update_slider_range(selected_stock, current_range):
         } for d in mark_dates
     }
     
-    return min_ts, max_ts, target_value, marks, min_ts, max_ts, target_value, marks
+    return min_ts, max_ts, target_value, marks
 
 @app.callback(
     Output("stock-dropdown", "value"),
@@ -353,92 +533,71 @@ def update_slider_range(selected_stock, current_range):
     prevent_initial_call=True
 )
 def switch_stock(prev_clicks, next_clicks, current_stock):
-    if current_stock not in stock_id_list:
+    data = dataset.current
+    if current_stock not in data.stock_position:
         raise PreventUpdate
 
-    current_idx = stock_id_list.index(current_stock)
+    current_idx = data.stock_position[current_stock]
     trigger = ctx.triggered_id
 
     if trigger == "btn-prev-stock":
         new_idx = max(current_idx - 1, 0)
     elif trigger == "btn-next-stock":
-        new_idx = min(current_idx + 1, len(stock_id_list) - 1)
+        new_idx = min(current_idx + 1, len(data.stock_id_list) - 1)
     else:
         raise PreventUpdate
 
-    return stock_id_list[new_idx]
+    return data.stock_id_list[new_idx]
 
-# link top and bottom slider
-@app.callback(
+# date-range interactions run in the browser (assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="sync_slider"),
     Output('date-slider-top', 'value', allow_duplicate=True),
     Input('date-slider-bottom', 'value'),
+    State('date-slider-top', 'value'),
     prevent_initial_call=True
 )
-def sync_top_slider(bottom_val):
-    return bottom_val
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="sync_slider"),
     Output('date-slider-bottom', 'value', allow_duplicate=True),
     Input('date-slider-top', 'value'),
+    State('date-slider-bottom', 'value'),
     prevent_initial_call=True
 )
-def sync_bottom_slider(top_val):
-    return top_val
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="range_by_button"),
     Output('date-slider-top', 'value', allow_duplicate=True),
     [Input('btn-1m', 'n_clicks'),
      Input('btn-3m', 'n_clicks'),
      Input('btn-6m', 'n_clicks'),
      Input('btn-1y', 'n_clicks'),
      Input('btn-all', 'n_clicks')],
-    [State('stock-dropdown', 'value')],
+    [State('stock-dropdown', 'value'),
+     State('stock-date-bounds', 'data')],
     prevent_initial_call=True
 )
-def update_range_by_button(n1, n3, n6, n1y, nall, selected_stock):
-    button_id = ctx.triggered_id
-    if not button_id:
-        raise PreventUpdate
-
-    stock_data = df[df['stock_id'] == selected_stock]
-    max_date = pd.to_datetime(stock_data['date'].max())
-    min_date_limit = pd.to_datetime(stock_data['date'].min())
-
-    if button_id == "btn-1m":
-        start_date = max_date - relativedelta(months=1)
-    elif button_id == "btn-3m":
-        start_date = max_date - relativedelta(months=3)
-    elif button_id == "btn-6m":
-        start_date = max_date - relativedelta(months=6)
-    elif button_id == "btn-1y":
-        start_date = max_date - relativedelta(years=1)
-    else:
-        start_date = min_date_limit
 
-    start_date = max(start_date, min_date_limit)
-    
-    return [int(start_date.timestamp()), int(max_date.timestamp())]
-
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="sliders_from_chart"),
     [Output('date-slider-top', 'value', allow_duplicate=True),
      Output('date-slider-bottom', 'value', allow_duplicate=True)],
     Input('stock-charts', 'relayoutData'),
     prevent_initial_call=True
 )
-def update_sliders_from_chart(relayoutData):
-    if relayoutData and ('xaxis.range[0]' in relayoutData or 'xaxis3.range[0]' in relayoutData):
-        try:
-            start_str = relayoutData.get('xaxis.range[0]') or relayoutData.get('xaxis3.range[0]')
-            end_str = relayoutData.get('xaxis.range[1]') or relayoutData.get('xaxis3.range[1]')
-            
-            start_ts = int(pd.to_datetime(start_str).timestamp())
-            end_ts = int(pd.to_datetime(end_str).timestamp())
-            
-            return [start_ts, end_ts], [start_ts, end_ts]
-        except Exception:
-            raise PreventUpdate
-            
-    raise PreventUpdate
+
+# moves the axes of the figure in the browser, or asks update_charts (through
+# chart-request) for one at the level of detail and window the range needs
+app.clientside_callback(
+    ClientsideFunction(namespace="charts", function_name="set_range"),
+    [Output('stock-charts', 'figure', allow_duplicate=True),
+     Output('chart-request', 'data')],
+    Input('date-slider-top', 'value'),
+    [State('stock-charts', 'figure'),
+     State('stock-date-bounds', 'data')],
+    prevent_initial_call=True
+)
 
 @app.callback(
     [
@@ -472,28 +631,29 @@ def update_stock_from_summary(stock_id):
     return stock_id
 
 
-@app.callback(
-    Output('stock-charts', 'figure'),
-    [Input('stock-dropdown', 'value'),
-     Input('date-slider-top', 'value')]
-)
-def update_charts(selected_stock, date_range):
+def chart_rangebreaks(data, dates):
+    # non-trading days come from the calendar; only the stock's own gaps
+    # (e.g. suspended days) are computed per render
+    start, end = dates.min(), dates.max()
+    lo, hi = data.trading_days.searchsorted(start), data.trading_days.searchsorted(end, side="right")
+    missing = data.trading_days[lo:hi].difference(dates)
+    return data.calendar.non_trading_days(start, end).union(missing)
+
+# a stock's figure is built once per level of detail and window (cached as
+# DashboardData.figure, per data version); date-range changes within it only
+# move the axis ranges of the figure already in the browser (set_range in
+# assets/clientside.js, with the same rules as chart_ranges)
+def stock_figure(data, stock_id, level, window_start, window_end):
+    """Chart of one stock's window_start..window_end at one level of detail: (plotly JSON dict, series).
+
+    Daily figures draw every bar; weekly and monthly ones draw aggregated bars
+    and LTTB-sampled lines as WebGL traces. `series` holds the bars and lines
+    for chart_ranges; update_charts sets the visible range.
+    """
+    daily = data.charts.frame(data.charts.rows(stock_id, window_start, window_end))
+    stock_data, lines = level_series(daily, level, ['MA5', 'MA10', 'MA20', 'K', 'D', 'DIF', 'MACD'])
+    Line = go.Scatter if level == "D" else go.Scattergl
 
-    if not date_range or not isinstance(date_range, list) or len(date_range) < 2:
-        raise PreventUpdate
-    
-    full_stock_data = df[df['stock_id'] == selected_stock].sort_values('date').copy()
-    if full_stock_data.empty:
-        return go.Figure()
-            
-    start_dt = pd.to_datetime(date_range[0], unit='s')
-    end_dt = pd.to_datetime(date_range[1], unit='s')
-
-    display_data = full_stock_data[(full_stock_data['date'] >= start_dt) & (full_stock_data['date'] <= end_dt)].copy()
-
-    if display_data.empty:
-        return go.Figure()
-    
     # set up subplots
     fig = make_subplots(
         rows=3, cols=1,
@@ -506,11 +666,11 @@ def update_charts(selected_stock, date_range):
     # first row: price
     fig.add_trace(
         go.Candlestick(
-            x=display_data['date'],
-            open=display_data['open'],
-            high=display_data['high'],
-            low=display_data['low'],
-            close=display_data['close'],
+            x=stock_data['date'],
+            open=stock_data['open'],
+            high=stock_data['high'],
+            low=stock_data['low'],
+            close=stock_data['close'],
             name="Price",
             increasing_line_color='red', 
             decreasing_line_color='green'    
@@ -526,9 +686,9 @@ def update_charts(selected_stock, date_range):
 
     for ma_col, color in ma_settings:
         fig.add_trace(
-            go.Scatter(
-                x=display_data['date'],
-                y=display_data[ma_col],
+            Line(
+                x=lines[ma_col][0],
+                y=lines[ma_col][1],
                 name=ma_col,
                 line=dict(color=color, width=2)
             ),
@@ -544,26 +704,21 @@ def update_charts(selected_stock, date_range):
         ('exit_emergency', 'EX_E', 'red'),
     ]
 
-    signal_counts = {}
-    y_gap = display_data['high'].max() * 0.015
-    base_offset = display_data['high'].max() * 0.01
-
+    # markers stack above the bar's high, one gap per earlier marker on the same bar
+    stock_dates = stock_data['date'].to_numpy()
+    stock_highs = stock_data['high'].to_numpy()
+    stacked = np.zeros(len(stock_data))
     for col, label, color in signals:
-        mask = display_data[col] == True
-        if mask.any():
-            sig_dates = display_data.loc[mask, 'date']
-            sig_highs = display_data.loc[mask, 'high']
-
-            y_positions = []
-            for d, h in zip(sig_dates, sig_highs):
-                count = signal_counts.get(d, 0)
-                y_pos = h + base_offset + (count * y_gap)
-                y_positions.append(y_pos)
-                signal_counts[d] = count + 1
+        sig_dates = data.events.stock_dates(col, stock_id, window_start, window_end)
+        if len(sig_dates):
+            # one marker per bar: the bar dated on or after the event (its week or month)
+            idx = np.unique(stock_dates.searchsorted(sig_dates).clip(max=len(stock_dates) - 1))
+            y_positions = stock_highs[idx] * (1 + MARKER_OFFSET + stacked[idx] * MARKER_GAP)
+            stacked[idx] += 1
 
             fig.add_trace(
-                go.Scatter(
-                    x=sig_dates,
+                Line(
+                    x=stock_dates[idx],
                     y=y_positions,
                     mode="markers+text",
                     name=label,
@@ -587,21 +742,22 @@ def update_charts(selected_stock, date_range):
         
     # second row: kd
     fig.add_trace(
-        go.Scatter(x=display_data['date'], y=display_data['K'], 
+        Line(x=lines['K'][0], y=lines['K'][1], 
                   mode='lines', name='K line', line=dict(color='blue')),
         row=2, col=1
     )
     fig.add_trace(
-        go.Scatter(x=display_data['date'], y=display_data['D'], 
+        Line(x=lines['D'][0], y=lines['D'][1], 
                   mode='lines', name='D line', line=dict(color='red')),
         row=2, col=1
     )
 
-    high_k = display_data[display_data['K'] > 80]
+    k_dates, k_values = lines['K']
+    high_k = k_values > 80
     fig.add_trace(
-        go.Scatter(
-            x=high_k['date'], 
-            y=high_k['K'], 
+        Line(
+            x=k_dates[high_k], 
+            y=k_values[high_k], 
             mode='markers', 
             name='K > 80',
             marker=dict(color='red', size=6),
@@ -610,11 +766,11 @@ def update_charts(selected_stock, date_range):
         row=2, col=1
     )
 
-    low_k = display_data[display_data['K'] < 20]
+    low_k = k_values < 20
     fig.add_trace(
-        go.Scatter(
-            x=low_k['date'], 
-            y=low_k['K'], 
+        Line(
+            x=k_dates[low_k], 
+            y=k_values[low_k], 
             mode='markers', 
             name='K < 20',
             marker=dict(color='green', size=6),
@@ -625,18 +781,18 @@ def update_charts(selected_stock, date_range):
     
     # third row: macd
     fig.add_trace(
-        go.Scatter(x=display_data['date'], y=display_data['DIF'], 
+        Line(x=lines['DIF'][0], y=lines['DIF'][1], 
                   mode='lines', name='DIF', line=dict(color='red')),
         row=3, col=1
     )
     fig.add_trace(
-        go.Scatter(x=display_data['date'], y=display_data['MACD'], 
+        Line(x=lines['MACD'][0], y=lines['MACD'][1], 
                   mode='lines', name='MACD', line=dict(color='blue')),
         row=3, col=1
     )
-    colors = ['red' if x >= 0 else 'green' for x in display_data['MACD_hist']]
+    colors = np.where(stock_data['MACD_hist'] >= 0, 'red', 'green')
     fig.add_trace(
-        go.Bar(x=display_data['date'], y=display_data['MACD_hist'], 
+        go.Bar(x=stock_data['date'], y=stock_data['MACD_hist'], 
                name='MACD histogram', marker_color=colors, showlegend=False),
         row=3, col=1
     )
@@ -653,11 +809,10 @@ def update_charts(selected_stock, date_range):
         dragmode='pan',
         margin=dict(l=65, r=30, t=50, b=50),
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-        xaxis_rangebreaks=[
-            dict(values=pd.date_range(start=display_data["date"].min(), end=display_data["date"].max())
-                 .difference(display_data["date"]))
-        ]
     )
+    # weekly and monthly bars are days apart anyway; only daily charts skip closed days
+    if level == "D" and len(stock_data):
+        fig.update_layout(xaxis_rangebreaks=[dict(values=chart_rangebreaks(data, stock_data["date"]))])
 
     fig.update_xaxes(
         hoverformat="%Y/%m/%d",
@@ -710,8 +865,80 @@ def update_charts(selected_stock, date_range):
         anno.xanchor = "left"
         anno.font.size = 14
         anno.y += 0.005
-    
-    return fig
+
+    fig = fig.to_plotly_json()
+    # what set_range needs to tell whether a range can be shown from this figure
+    fig['layout']['meta'] = {'detail': {
+        'level': level,
+        'window': None if window_start is None else [int(window_start.timestamp()), int(window_end.timestamp())],
+        'half_bar': HALF_BAR_DAYS[level] * 86400,
+    }}
+    return fig, (level, stock_data, lines)
+
+def chart_ranges(series, start_dt, end_dt):
+    """Axis ranges showing a figure's bars from start_dt to end_dt, y fitted to those bars."""
+    level, bars, lines = series
+    ranges = {axis: [start_dt, end_dt] for axis in ('xaxis', 'xaxis2', 'xaxis3')}
+    dates = bars['date'].to_numpy()
+    lo, hi = dates.searchsorted(np.datetime64(start_dt), side='left'), dates.searchsorted(np.datetime64(end_dt), side='right')
+    if lo >= hi:
+        return ranges
+
+    # half a bar of margin, as autorange leaves around candlesticks; lines
+    # count where they fall inside it
+    half_bar = pd.Timedelta(days=HALF_BAR_DAYS[level])
+    x_range = [pd.Timestamp(dates[lo]) - half_bar, pd.Timestamp(dates[hi - 1]) + half_bar]
+    ranges = {axis: x_range for axis in ranges}
+
+    def visible(col):
+        x, y = lines[col]
+        return y[x.searchsorted(np.datetime64(x_range[0]), side='left'):x.searchsorted(np.datetime64(x_range[1]), side='right')]
+
+    window = bars.iloc[lo:hi]
+    # room for up to two stacked signal markers
+    price = [window['low'].to_numpy(), window['high'].to_numpy() * (1 + MARKER_OFFSET + MARKER_GAP)]
+    price += [visible(col) for col in ('MA5', 'MA10', 'MA20')]
+    macd = [window['MACD_hist'].to_numpy(), np.zeros(1)] + [visible(col) for col in ('DIF', 'MACD')]
+    for axis, values in (('yaxis', price), ('yaxis3', macd)):
+        lo = min(np.nanmin(v, initial=np.inf) for v in values)
+        hi = max(np.nanmax(v, initial=-np.inf) for v in values)
+        if np.isfinite(lo) and np.isfinite(hi):
+            pad = (hi - lo) * 0.05 or abs(hi) * 0.05 or 1
+            ranges[axis] = [lo - pad, hi + pad]
+    return ranges
+
+@app.callback(
+    [Output('stock-charts', 'figure'),
+     Output('date-slider-top', 'min'), Output('date-slider-top', 'max'), Output('date-slider-top', 'value'), Output('date-slider-top', 'marks'),
+     Output('date-slider-bottom', 'min'), Output('date-slider-bottom', 'max'), Output('date-slider-bottom', 'value'), Output('date-slider-bottom', 'marks')],
+    [Input('stock-dropdown', 'value'),
+     Input('data-version', 'data'),
+     Input('chart-request', 'data')],
+    State('date-slider-top', 'value')
+)
+def update_charts(selected_stock, version, request, current_range):
+    data = dataset.current
+    if selected_stock not in data.stock_position:
+        return (go.Figure(),) + (no_update,) * 8
+
+    if ctx.triggered_id == 'chart-request' and request:
+        # the sliders are already at the requested range
+        slider = (no_update,) * 4
+        start_ts, end_ts = request['range']
+    else:
+        slider = slider_range(data, selected_stock, current_range)
+        start_ts, end_ts = slider[2]
+    start_dt = pd.to_datetime(start_ts, unit='s')
+    end_dt = pd.to_datetime(end_ts, unit='s')
+
+    level = detail_level(start_dt, end_dt)
+    fig, series = data.figure(selected_stock, level, *detail_window(level, start_dt, end_dt))
+    ranges = chart_ranges(series, start_dt, end_dt)
+
+    layout = dict(fig['layout'])
+    for axis, value in ranges.items():
+        layout[axis] = {**layout.get(axis, {}), 'range': value, 'autorange': False}
+    return ({'data': fig['data'], 'layout': layout},) + slider + slider
 
 if __name__ == '__main__':
     app.run(debug=True, port=8050)
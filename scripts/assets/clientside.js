@@ -7,3 +7,187 @@ window.dccFunctions.transform_to_date = function (value) {
     date.getFullYear() + "/" + (date.getMonth() + 1) + "/" + date.getDate()
   );
 };
+
+// =========================
+// Chart range callbacks
+// =========================
+// Date-range interactions run in the browser: the server only sends a new
+// figure when the stock changes, or when a range needs another level of
+// detail or lies outside the figure's window (see update_charts in app.py).
+// Slider values are Unix seconds of naive dates, i.e. UTC.
+
+const DAY_MS = 24 * 3600 * 1000;
+const TYPED_ARRAYS = {
+  f8: Float64Array, f4: Float32Array,
+  i1: Int8Array, i2: Int16Array, i4: Int32Array,
+  u1: Uint8Array, u2: Uint16Array, u4: Uint32Array,
+};
+
+// "2024-03-31", "2024-03-31 12:00:00.0000" or "2024-03-31T00:00:00.000000000" → ms
+function dateMs(text) {
+  const s = String(text).replace(" ", "T");
+  const [day, time = "00:00:00"] = s.split("T");
+  return Date.parse(day + "T" + time.slice(0, 8).padEnd(8, ":00") + "Z");
+}
+
+function dateText(ms) {
+  return new Date(ms).toISOString().slice(0, 19).replace("T", " ");
+}
+
+// trace arrays arrive as plain arrays or as plotly's {dtype, bdata} specs
+function values(array) {
+  if (!array || Array.isArray(array) || ArrayBuffer.isView(array)) {
+    return array || [];
+  }
+  const bytes = Uint8Array.from(atob(array.bdata), (c) => c.charCodeAt(0));
+  return new TYPED_ARRAYS[array.dtype](bytes.buffer);
+}
+
+function sameRange(a, b) {
+  return Array.isArray(a) && Array.isArray(b) && a.length === 2 && b.length === 2 &&
+    dateMs(a[0]) === dateMs(b[0]) && dateMs(a[1]) === dateMs(b[1]);
+}
+
+// bar size for a span: the first of [[level, max days], ...] that covers it
+// (detail_level in chart_detail.py)
+function detailLevel(levels, startMs, endMs) {
+  const span = (endMs - startMs) / DAY_MS;
+  const level = levels.find(([, maxSpan]) => maxSpan === null || span <= maxSpan);
+  return level && level[0];
+}
+
+// x ranges around the bars from start to end, y ranges fitted to those bars
+// and to the line points inside the x range (same rules as chart_ranges in app.py)
+function chartRanges(figure, startMs, endMs, markerRoom, halfBarMs) {
+  const candles = figure.data.find((trace) => trace.type === "candlestick");
+  const dates = candles ? candles.x.map(dateMs) : [];
+  const lo = dates.findIndex((ms) => ms >= startMs);
+  let hi = dates.length;
+  while (hi > 0 && dates[hi - 1] > endMs) {
+    hi--;
+  }
+
+  if (lo < 0 || lo >= hi) {
+    const x = [dateText(startMs), dateText(endMs)];
+    return { xaxis: x, xaxis2: x, xaxis3: x };
+  }
+  const xLow = dates[lo] - halfBarMs;
+  const xHigh = dates[hi - 1] + halfBarMs;
+  const x = [dateText(xLow), dateText(xHigh)];
+  const ranges = { xaxis: x, xaxis2: x, xaxis3: x };
+
+  const y = { y: [Infinity, -Infinity], y3: [0, 0] };
+  const add = (axis, array, scale = 1, visible = (i) => i >= lo && i < hi) => {
+    const v = values(array);
+    for (let i = 0; i < v.length; i++) {
+      const value = v[i] * scale;
+      if (visible(i) && Number.isFinite(value)) {
+        y[axis][0] = Math.min(y[axis][0], value);
+        y[axis][1] = Math.max(y[axis][1], value);
+      }
+    }
+  };
+  // weekly / monthly lines have their own dates, between the bars'
+  const addLine = (axis, trace) => {
+    const x = trace.x.map(dateMs);
+    add(axis, trace.y, 1, (i) => x[i] >= xLow && x[i] <= xHigh);
+  };
+  for (const trace of figure.data) {
+    const axis = trace.yaxis || "y";
+    if (trace.type === "candlestick") {
+      add("y", trace.low);
+      add("y", trace.high, markerRoom);
+    } else if (trace.type === "bar") {
+      add("y3", trace.y);
+    } else if (axis === "y" && trace.mode !== "markers+text") {
+      addLine("y", trace);
+    } else if (axis === "y3") {
+      addLine("y3", trace);
+    }
+  }
+
+  for (const [axis, key] of [["y", "yaxis"], ["y3", "yaxis3"]]) {
+    const [low, high] = y[axis];
+    if (Number.isFinite(low) && Number.isFinite(high)) {
+      const pad = (high - low) * 0.05 || Math.abs(high) * 0.05 || 1;
+      ranges[key] = [low - pad, high + pad];
+    }
+  }
+  return ranges;
+}
+
+// relativedelta(months=n) backwards: the day is clamped to the target month
+function monthsBefore(ms, months) {
+  const date = new Date(ms);
+  const total = date.getUTCFullYear() * 12 + date.getUTCMonth() - months;
+  const year = Math.floor(total / 12);
+  const month = total - year * 12;
+  const lastDay = new Date(Date.UTC(year, month + 1, 0)).getUTCDate();
+  return Date.UTC(year, month, Math.min(date.getUTCDate(), lastDay),
+    date.getUTCHours(), date.getUTCMinutes(), date.getUTCSeconds());
+}
+
+const BUTTON_MONTHS = { "btn-1m": 1, "btn-3m": 3, "btn-6m": 6, "btn-1y": 12 };
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  charts: {
+    sync_slider: function (value, other) {
+      if (!value || (other && value[0] === other[0] && value[1] === other[1])) {
+        return window.dash_clientside.no_update;
+      }
+      return value;
+    },
+
+    range_by_button: function (n1, n3, n6, n1y, nall, stock, chart) {
+      const triggered = window.dash_clientside.callback_context.triggered_id;
+      const bounds = chart && chart.bounds[stock];
+      if (!triggered || !bounds) {
+        return window.dash_clientside.no_update;
+      }
+      const [minTs, maxTs] = bounds;
+      const months = BUTTON_MONTHS[triggered];
+      const start = months ? Math.floor(monthsBefore(maxTs * 1000, months) / 1000) : minTs;
+      return [Math.max(start, minTs), maxTs];
+    },
+
+    sliders_from_chart: function (relayout) {
+      const no_update = window.dash_clientside.no_update;
+      if (!relayout) {
+        return [no_update, no_update];
+      }
+      const start = relayout["xaxis.range[0]"] || relayout["xaxis3.range[0]"];
+      const end = relayout["xaxis.range[1]"] || relayout["xaxis3.range[1]"];
+      const range = [Math.floor(dateMs(start) / 1000), Math.floor(dateMs(end) / 1000)];
+      if (!start || !end || !Number.isFinite(range[0]) || !Number.isFinite(range[1])) {
+        return [no_update, no_update];
+      }
+      return [range, range];
+    },
+
+    set_range: function (value, figure, chart) {
+      const no_update = window.dash_clientside.no_update;
+      const detail = figure && figure.layout && figure.layout.meta && figure.layout.meta.detail;
+      if (!value || !detail || !chart) {
+        return [no_update, no_update];
+      }
+
+      // another bar size, or a range the figure does not hold: the server sends a new figure
+      const held = detail.window;
+      if (detailLevel(chart.detail_levels, value[0] * 1000, value[1] * 1000) !== detail.level ||
+          (held && (value[0] < held[0] || value[1] > held[1]))) {
+        return [no_update, { range: value, at: Date.now() }];
+      }
+
+      const ranges = chartRanges(figure, value[0] * 1000, value[1] * 1000, chart.marker_room, detail.half_bar * 1000);
+      if (figure.layout.xaxis && sameRange(figure.layout.xaxis.range, ranges.xaxis)) {
+        return [no_update, no_update];
+      }
+
+      const layout = Object.assign({}, figure.layout);
+      for (const [axis, range] of Object.entries(ranges)) {
+        layout[axis] = Object.assign({}, layout[axis], { range: range, autorange: false });
+      }
+      return [Object.assign({}, figure, { layout: layout }), no_update];
+    },
+  },
+});
@@ -0,0 +1,264 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from indicators import segment_positions
+from strategy import SIGNAL_BITS, has_signal
+
+# =========================
+# Config
+# =========================
+DAILY_FILE = Path("data/processed/daily.parquet")
+OUT_DIR = Path("data/processed/backtest")
+
+ENTRY_SIGNAL = "any_entry"
+EXIT_SIGNALS = ("exit_trend", "exit_emergency")
+
+# TWSE costs: brokerage on both sides, transaction tax when selling
+FEE_RATE = 0.001425
+TAX_RATE = 0.003
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+# =========================
+# Array kernels
+# =========================
+# All inputs are arrays over a frame sorted by stock_id / date; `pos` is each
+# row's position inside its stock (indicators.segment_positions). Trades
+# happen at the close of the bar that signals them.
+
+def long_positions(entry, exit, pos):
+    """True where a stock is held after the close: its latest entry is more recent than its latest exit.
+
+    Entries while long and exits while flat are ignored; a bar with both
+    entry and exit signals ends flat.
+    """
+    idx = np.arange(len(entry))
+    start = idx - pos
+    last_entry = np.maximum.accumulate(np.where(entry, idx, -1))
+    last_exit = np.maximum.accumulate(np.where(exit, idx, -1))
+    return (last_entry >= start) & (last_entry > last_exit)
+
+def held_positions(long, pos):
+    """Position at the previous close (False on each stock's first bar)."""
+    held = np.zeros(len(long), dtype=bool)
+    held[1:] = long[:-1]
+    held[pos == 0] = False
+    return held
+
+def strategy_returns(close, long, pos, fee=FEE_RATE, tax=TAX_RATE):
+    """Per-bar return of each stock's position, net of costs on the bars where it changes."""
+    close = pd.Series(close).groupby(np.cumsum(pos == 0)).ffill().to_numpy()
+    held = held_positions(long, pos)
+
+    market = np.zeros(len(close))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        market[1:] = close[1:] / close[:-1] - 1
+    market[(pos == 0) | ~np.isfinite(market)] = 0
+
+    bought = long & ~held
+    sold = held & ~long
+    return np.where(held, market, 0) - fee * bought - (fee + tax) * sold
+
+def drawdown(equity, pos):
+    """Distance below the running peak, which starts at the initial capital of 1.0 (a first-bar loss counts)."""
+    peak = pd.Series(equity).groupby(np.cumsum(pos == 0)).cummax().to_numpy()
+    return equity / np.maximum(peak, 1.0) - 1
+
+def trade_bounds(long, ret, pos):
+    """Entry row, last row, closed flag and net return of every trade; open trades run to the stock's last row."""
+    held = held_positions(long, pos)
+    entries = np.flatnonzero(long & ~held)
+    exits = np.flatnonzero(held & ~long)
+
+    # each entry's exit is the first exit after it, if it is in the same stock
+    stock_end = np.r_[np.flatnonzero(pos[1:] == 0), len(pos) - 1]
+    end_of_stock = stock_end[np.searchsorted(stock_end, entries)]
+    k = np.searchsorted(exits, entries)
+    nxt = np.where(k < len(exits), exits[np.minimum(k, len(exits) - 1)], len(pos))
+    closed = nxt <= end_of_stock
+    last = np.where(closed, nxt, end_of_stock)
+
+    log_growth = np.r_[0, np.cumsum(np.log1p(ret))]
+    trade_ret = np.expm1(log_growth[last + 1] - log_growth[entries])
+    return entries, last, closed, trade_ret
+
+def trade_table(stock_ids, dates, long, ret, pos):
+    """One row per trade: entry / exit bar, holding bars and net return; open trades have no exit."""
+    entries, last, closed, trade_ret = trade_bounds(long, ret, pos)
+    return pd.DataFrame({
+        "stock_id": stock_ids[entries],
+        "entry_date": dates[entries],
+        "exit_date": np.where(closed, dates[last], np.datetime64("NaT")),
+        "bars": last - entries,
+        "return": trade_ret,
+        "closed": closed,
+    })
+
+def portfolio_returns(ret, long, pos, date_codes):
+    """Per-date mean return over the positions open at the previous close or opened that day; 0 with none.
+
+    Returns (returns, positions) indexed by date code.
+    """
+    held = held_positions(long, pos)
+    active = held | (long & ~held)
+    n_dates = int(date_codes.max()) + 1 if len(date_codes) else 0
+    positions = np.bincount(date_codes, weights=active, minlength=n_dates)
+    total = np.bincount(date_codes, weights=np.where(active, ret, 0), minlength=n_dates)
+    return np.where(positions > 0, total / np.maximum(positions, 1), 0), positions.astype(np.int64)
+
+def performance(trade_ret, closed, bars, port_ret):
+    """Summary statistics from closed / open trades and the portfolio's daily returns."""
+    done = trade_ret[closed]
+    equity = np.exp(np.cumsum(np.log1p(port_ret)))
+    years = len(port_ret) / TRADING_DAYS_PER_YEAR
+    total = equity[-1] - 1 if len(equity) else 0.0
+    std = port_ret.std()
+    return {
+        "trades": int(closed.sum()),
+        "open_trades": int((~closed).sum()),
+        "win_rate": float((done > 0).mean()) if len(done) else np.nan,
+        "avg_trade_return": float(done.mean()) if len(done) else np.nan,
+        "avg_bars_held": float(bars[closed].mean()) if len(done) else np.nan,
+        "total_return": float(total),
+        "cagr": float((1 + total) ** (1 / years) - 1) if years > 0 and total > -1 else np.nan,
+        "sharpe": float(port_ret.mean() / std * np.sqrt(TRADING_DAYS_PER_YEAR)) if std > 0 else np.nan,
+        "max_drawdown": float((equity / np.maximum.accumulate(np.maximum(equity, 1.0)) - 1).min()) if len(equity) else 0.0,
+    }
+
+
+# =========================
+# Backtest
+# =========================
+def signal_flags(df, names):
+    """OR of the named signals, read from their bool columns or from signal_code."""
+    flags = np.zeros(len(df), dtype=bool)
+    for name in names:
+        if name in df:
+            flags |= df[name].to_numpy(dtype=bool)
+        elif name in SIGNAL_BITS and "signal_code" in df:
+            flags |= has_signal(df["signal_code"].to_numpy(), name)
+        else:
+            raise KeyError(f"unknown signal: {name}")
+    return flags
+
+def run_backtest(df: pd.DataFrame, entry=ENTRY_SIGNAL, exits=EXIT_SIGNALS, fee=FEE_RATE, tax=TAX_RATE):
+    """Turn the signals of every stock into positions, trades and equity curves at once.
+
+    Returns a dict of frames:
+      rows       per stock / date position, net return, equity and drawdown
+      trades     one row per trade
+      stocks     per-stock trades, win rate, total return, max drawdown
+      portfolio  per date: equal weight over the stocks held the previous close
+    """
+    df = df.sort_values(["stock_id", "date"], kind="stable").reset_index(drop=True)
+    stock_ids = df["stock_id"].to_numpy()
+    dates = df["date"].to_numpy()
+    pos = segment_positions(stock_ids)
+
+    long = long_positions(signal_flags(df, [entry]), signal_flags(df, exits), pos)
+    ret = strategy_returns(df["close"].to_numpy(dtype=np.float64), long, pos, fee, tax)
+
+    segments = np.cumsum(pos == 0)
+    equity = np.exp(pd.Series(np.log1p(ret)).groupby(segments).cumsum().to_numpy())
+    rows = pd.DataFrame({
+        "stock_id": stock_ids,
+        "date": dates,
+        "long": long,
+        "return": ret,
+        "equity": equity,
+        "drawdown": drawdown(equity, pos),
+    })
+
+    trades = trade_table(stock_ids, dates, long, ret, pos)
+    closed = trades[trades["closed"]]
+
+    stocks = pd.DataFrame({
+        "trades": closed.groupby("stock_id").size(),
+        "win_rate": (closed["return"] > 0).groupby(closed["stock_id"]).mean(),
+        "total_return": rows.groupby("stock_id")["equity"].last() - 1,
+        "max_drawdown": rows.groupby("stock_id")["drawdown"].min(),
+    }).fillna({"trades": 0}).astype({"trades": int})
+    stocks.index.name = "stock_id"
+
+    date_index, date_codes = np.unique(dates, return_inverse=True)
+    port_ret, positions = portfolio_returns(ret, long, pos, date_codes)
+    portfolio = pd.DataFrame({"return": port_ret, "positions": positions}, index=pd.Index(date_index, name="date"))
+    portfolio["equity"] = np.exp(np.log1p(portfolio["return"]).cumsum())
+    portfolio["drawdown"] = portfolio["equity"] / portfolio["equity"].cummax().clip(lower=1.0) - 1
+
+    return {"rows": rows, "trades": trades, "stocks": stocks, "portfolio": portfolio}
+
+def summary(result):
+    trades = result["trades"]
+    return performance(
+        trades["return"].to_numpy(),
+        trades["closed"].to_numpy(),
+        trades["bars"].to_numpy(),
+        result["portfolio"]["return"].to_numpy(),
+    )
+
+def save_result(result, out_dir=OUT_DIR):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    result["rows"].to_parquet(out_dir / "equity_by_stock.parquet", index=False)
+    result["trades"].to_parquet(out_dir / "trades.parquet", index=False)
+    result["stocks"].to_parquet(out_dir / "stocks.parquet")
+    result["portfolio"].to_parquet(out_dir / "portfolio.parquet")
+    print(f"Successfully saved backtest results to {out_dir}")
+
+
+# =========================
+# Main
+# =========================
+def main(daily_file=DAILY_FILE, start=None, end=None, entry=ENTRY_SIGNAL, exits=EXIT_SIGNALS,
+         fee=FEE_RATE, tax=TAX_RATE, out_dir=OUT_DIR):
+    columns = ["stock_id", "date", "close", "signal_code"]
+    df = pd.read_parquet(daily_file, columns=columns)
+    if start:
+        df = df[df["date"] >= pd.to_datetime(start)]
+    if end:
+        df = df[df["date"] <= pd.to_datetime(end)]
+
+    t0 = time.perf_counter()
+    result = run_backtest(df, entry, exits, fee, tax)
+    elapsed = time.perf_counter() - t0
+
+    print(f"{df['stock_id'].nunique()} stocks, {len(df)} rows, {elapsed:.2f} s")
+    for key, value in summary(result).items():
+        print(f"{key:>18}: {value:.4f}" if isinstance(value, float) else f"{key:>18}: {value}")
+
+    if out_dir:
+        save_result(result, out_dir)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backtest the strategy signals in daily.parquet.")
+    parser.add_argument("--daily", default=DAILY_FILE)
+    parser.add_argument("--start", help="YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY-MM-DD")
+    parser.add_argument("--entry", default=ENTRY_SIGNAL, help="entry signal")
+    parser.add_argument("--exits", default=",".join(EXIT_SIGNALS), help="comma separated exit signals")
+    parser.add_argument("--fee", type=float, default=FEE_RATE, help="brokerage per side")
+    parser.add_argument("--tax", type=float, default=TAX_RATE, help="tax on sells")
+    parser.add_argument("--out", default=OUT_DIR, help="output folder ('' to skip writing)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        daily_file=args.daily,
+        start=args.start,
+        end=args.end,
+        entry=args.entry,
+        exits=args.exits.split(","),
+        fee=args.fee,
+        tax=args.tax,
+        out_dir=args.out,
+    )
@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+import build_table
+from indicators import (
+    MA_WINDOWS, VOLUME_MA_WINDOW, KD_N, KD_ALPHA, MACD_FAST, MACD_SLOW, MACD_SIGNAL,
+    ewm_mean,
+)
+from trading_calendar import TradingCalendar
+
+# =========================
+# Config
+# =========================
+N_STOCKS = 1200
+N_DAYS = 750
+REPEAT = 3
+
+# compute_indicators takes these from exactly rounded window sums; pandas'
+# running sum can be off in the last bit, so they are compared with a tolerance
+ROLLING_COLUMNS = [*(f"MA{window}" for window in MA_WINDOWS), "vol_ma5"]
+ROLLING_RTOL = 1e-12
+# volume / vol_ma5 rounded to 2 decimals: a last-bit change can move it one step
+RATIO_COLUMNS = ["volume_ratio_5d"]
+RATIO_ATOL = 0.01 + 1e-9
+
+
+# =========================
+# Per-stock reference (the groupby().apply pipeline compute_indicators replaced)
+# =========================
+def add_ma_features(df):
+    for window in MA_WINDOWS:
+        df[f"MA{window}"] = df["close"].rolling(window).mean()
+    return df
+
+def add_kd_features(df, n=KD_N, state=None):
+    state = {} if state is None else state
+
+    low_n  = df["low"].rolling(n, min_periods=1).min()
+    high_n = df["high"].rolling(n, min_periods=1).max()
+
+    denom = (high_n - low_n).replace(0, np.nan)
+    rsv = 100 * (df["close"] - low_n) / denom
+
+    k, state["K"] = ewm_mean(rsv, alpha=KD_ALPHA)
+    df["K"] = k.round(2)
+    d, state["D"] = ewm_mean(df["K"], alpha=KD_ALPHA)
+    df["D"] = d.round(2)
+    return df
+
+def add_macd_features(df, fast=MACD_FAST, slow=MACD_SLOW, signal=MACD_SIGNAL, state=None):
+    state = {} if state is None else state
+
+    ema_fast, state["ema_fast"] = ewm_mean(df["close"], span=fast)
+    ema_slow, state["ema_slow"] = ewm_mean(df["close"], span=slow)
+
+    df["DIF"] = (ema_fast - ema_slow).round(2)
+    macd, state["MACD"] = ewm_mean(df["DIF"], span=signal)
+    df["MACD"] = macd.round(2)
+    df["MACD_hist"] = df["DIF"] - df["MACD"]
+    return df
+
+def compute_indicators_by_stock(base_df, states=None):
+    states = {} if states is None else states
+
+    def with_state(func):
+        return lambda g: func(g, state=states.setdefault(g.name, {}))
+
+    final_df = (
+        base_df
+        .sort_values(["stock_id", "date"])
+        .groupby("stock_id", group_keys=False)
+        .apply(add_ma_features)
+        .pipe(lambda d: d.groupby("stock_id", group_keys=False).apply(with_state(add_kd_features)))
+        .pipe(lambda d: d.groupby("stock_id", group_keys=False).apply(with_state(add_macd_features)))
+    )
+
+    final_df['close_change_pct'] = (
+        final_df.groupby("stock_id")["close"]
+        .pct_change() * 100
+    ).round(2)
+
+    final_df['close_3d_change_pct'] = (
+        final_df.groupby("stock_id")["close"]
+        .transform(lambda x: (x - x.shift(3)) / x.shift(3) * 100)
+    ).round(2)
+
+    final_df['vol_ma5'] = final_df.groupby("stock_id")["volume"].transform(lambda x: x.rolling(VOLUME_MA_WINDOW).mean())
+    final_df['volume_ratio_5d'] = (final_df['volume'] / final_df['vol_ma5']).round(2)
+    return final_df
+
+
+# =========================
+# Input
+# =========================
+def synthetic_quotes(n_stocks=N_STOCKS, n_days=N_DAYS, seed=0):
+    """Random-walk quotes with a few suspended (all-NaN) days."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2022-01-03", periods=n_days)
+    stock_ids = [f"{1101 + i}" for i in range(n_stocks)]
+
+    close = np.round(rng.uniform(10, 500, n_stocks) * np.cumprod(1 + rng.normal(0, 0.02, (n_days, n_stocks)), axis=0), 2)
+    high = np.round(close * (1 + np.abs(rng.normal(0, 0.01, close.shape))), 2)
+    low = np.round(close * (1 - np.abs(rng.normal(0, 0.01, close.shape))), 2)
+    volume = np.round(rng.integers(0, 100_000, close.shape) / 1000, 2)
+
+    suspended = rng.random(close.shape) < 0.01
+    for a in (close, high, low):
+        a[suspended] = np.nan
+
+    df = pd.DataFrame({
+        "date": np.repeat(dates, n_stocks),
+        "stock_id": np.tile(stock_ids, n_days),
+        "stock_name": np.tile([f"S{s}" for s in stock_ids], n_days),
+        "open": close.ravel(),
+        "high": high.ravel(),
+        "low": low.ravel(),
+        "close": close.ravel(),
+        "volume": volume.ravel(),
+    })
+    return df
+
+def built_quotes():
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = build_table.load_days(build_table.day_sources(), TradingCalendar())
+    return pd.concat(rows.values(), ignore_index=True)
+
+
+# =========================
+# Benchmark
+# =========================
+def best_of(func, base_df, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func(base_df, {})
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+def bench(base_df, repeat=REPEAT):
+    print(f"{base_df['stock_id'].nunique()} stocks, {len(base_df)} rows")
+
+    old_sec, old = best_of(compute_indicators_by_stock, base_df, repeat)
+    new_sec, new = best_of(build_table.compute_indicators, base_df, repeat)
+
+    old, new = old.reset_index(drop=True), new.reset_index(drop=True)
+    approx = ROLLING_COLUMNS + RATIO_COLUMNS
+    pd.testing.assert_frame_equal(old.drop(columns=approx), new.drop(columns=approx), check_exact=True)
+    pd.testing.assert_frame_equal(old[ROLLING_COLUMNS], new[ROLLING_COLUMNS], check_exact=False, rtol=ROLLING_RTOL)
+    pd.testing.assert_frame_equal(old[RATIO_COLUMNS], new[RATIO_COLUMNS], check_exact=False, rtol=0, atol=RATIO_ATOL)
+    last_bits = (old[ROLLING_COLUMNS] != new[ROLLING_COLUMNS]) & old[ROLLING_COLUMNS].notna()
+    ratio_steps = (old[RATIO_COLUMNS] != new[RATIO_COLUMNS]) & old[RATIO_COLUMNS].notna()
+
+    print(f"{'path':>20} {'seconds':>8}")
+    print(f"{'groupby().apply':>20} {old_sec:>8.2f}")
+    print(f"{'segmented kernels':>20} {new_sec:>8.2f}")
+    print(f"speedup {old_sec / new_sec:.1f}x, outputs identical except the last bit of "
+          f"{last_bits.any(axis=1).sum()} / {len(old)} rows of {', '.join(ROLLING_COLUMNS)} "
+          f"({ratio_steps.any(axis=1).sum()} rows of {', '.join(RATIO_COLUMNS)} one rounding step apart)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time compute_indicators against the per-stock groupby().apply pipeline.")
+    parser.add_argument("--stocks", type=int, default=N_STOCKS, help="synthetic stocks")
+    parser.add_argument("--days", type=int, default=N_DAYS, help="synthetic trading days")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--data", action="store_true", help="use the day files under data/ instead of synthetic quotes")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    base_df = built_quotes() if args.data else synthetic_quotes(args.stocks, args.days)
+    bench(base_df, args.repeat)
@@ -0,0 +1,180 @@
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+from chart_data import CHART_INDEX_FILE
+from summary_snapshots import SNAPSHOT_INDEX_FILE
+
+# =========================
+# Config
+# =========================
+HOST = "127.0.0.1"
+PORT = 8070
+CLIENTS = 8
+SECONDS = 20
+# chart requests go to this many stocks (the rest of the traffic is summary pages)
+CHART_STOCKS = 50
+CHART_SHARE = 0.5
+
+
+# =========================
+# Requests
+# =========================
+# the same POST bodies the browser sends to /_dash-update-component
+def callback_body(outputs, inputs, state=()):
+    return {
+        "output": ".." + "...".join(f"{id_}.{prop}" for id_, prop in outputs) + "..",
+        "outputs": [{"id": id_, "property": prop} for id_, prop in outputs],
+        "inputs": [{"id": id_, "property": prop, "value": value} for id_, prop, value in inputs],
+        "state": [{"id": id_, "property": prop, "value": value} for id_, prop, value in state],
+        "changedPropIds": [f"{inputs[0][0]}.{inputs[0][1]}"],
+    }
+
+def chart_body(stock_id):
+    sliders = [(slider, prop) for slider in ("date-slider-top", "date-slider-bottom") for prop in ("min", "max", "value", "marks")]
+    return callback_body(
+        [("stock-charts", "figure"), *sliders],
+        [("stock-dropdown", "value", stock_id), ("data-version", "data", None), ("chart-request", "data", None)],
+        [("date-slider-top", "value", None)],
+    )
+
+def summary_body(date, page):
+    return callback_body(
+        [("summary-table", "data"), ("summary-table", "page_count"), ("summary-table", "page_current")],
+        [
+            ("summary-date-dropdown", "value", date),
+            ("summary-table", "page_current", page),
+            ("summary-table", "page_size", 20),
+            ("summary-table", "sort_by", [{"column_id": "volume_ratio_5d", "direction": "desc"}]),
+            ("summary-table", "filter_query", ""),
+            ("data-version", "data", None),
+        ],
+    )
+
+def request_bodies(n, seed=0):
+    """n callback requests: chart for a few stocks, summary pages of random dates."""
+    with np.load(CHART_INDEX_FILE, allow_pickle=False) as f:
+        stock_ids = f["stock_id"].tolist()
+    with np.load(SNAPSHOT_INDEX_FILE, allow_pickle=False) as f:
+        dates = [str(d)[:10] for d in f["dates"]]
+
+    rng = random.Random(seed)
+    stocks = rng.sample(stock_ids, min(CHART_STOCKS, len(stock_ids)))
+    bodies = []
+    for _ in range(n):
+        if rng.random() < CHART_SHARE:
+            bodies.append(chart_body(rng.choice(stocks)))
+        else:
+            bodies.append(summary_body(rng.choice(dates), rng.randrange(5)))
+    return [json.dumps(body).encode() for body in bodies]
+
+
+# =========================
+# Server
+# =========================
+def start_gunicorn(workers, preload=False, host=HOST, port=PORT):
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "--pythonpath", str(Path(__file__).parent),
+        "--workers", str(workers),
+        "--bind", f"{host}:{port}",
+        "--timeout", "120",
+        *(["--preload"] if preload else []),
+        "app:server",
+    ]
+    server = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    url = f"http://{host}:{port}/_dash-layout"
+    for _ in range(600):
+        try:
+            urllib.request.urlopen(url).read()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {server.returncode}: {' '.join(command)}")
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+def worker_pids(master):
+    with open(f"/proc/{master}/task/{master}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+def memory_mb(pid):
+    """Rss, Pss (shared pages split between the processes mapping them) and private MB of a process."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return fields["Rss"], fields["Pss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+# =========================
+# Benchmark
+# =========================
+def run_clients(bodies, clients, seconds, host=HOST, port=PORT):
+    url = f"http://{host}:{port}/_dash-update-component"
+    latencies = [[] for _ in range(clients)]
+    deadline = time.perf_counter() + seconds
+
+    def client(i):
+        k = i
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(url, data=bodies[k % len(bodies)], headers={"Content-Type": "application/json"})
+            t0 = time.perf_counter()
+            urllib.request.urlopen(request).read()
+            latencies[i].append(time.perf_counter() - t0)
+            k += clients
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [t for per_client in latencies for t in per_client], time.perf_counter() - t0
+
+def bench(workers_list, clients=CLIENTS, seconds=SECONDS, preload=False):
+    bodies = request_bodies(2000)
+    print(f"{'workers':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8} {'PSS MB':>8} {'priv MB':>8} {'total PSS':>10}")
+    for workers in workers_list:
+        server = start_gunicorn(workers, preload)
+        try:
+            # every worker builds its figure cache before the timed run
+            run_clients(bodies, clients, max(2.0, seconds / 4))
+            latencies, elapsed = run_clients(bodies, clients, seconds)
+            memory = [memory_mb(pid) for pid in worker_pids(server.pid)]
+        finally:
+            server.terminate()
+            server.wait()
+
+        rss, pss, private = (statistics.mean(m[i] for m in memory) for i in range(3))
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(
+            f"{workers:>8} {len(latencies) / elapsed:>8.1f} {p50:>8.0f} {p95:>8.0f} "
+            f"{rss:>8.0f} {pss:>8.0f} {private:>8.0f} {sum(m[1] for m in memory):>10.0f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the dashboard with gunicorn and report throughput and memory per worker count.")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--clients", type=int, default=CLIENTS, help="concurrent client threads")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="timed run per worker count")
+    parser.add_argument("--preload", action="store_true", help="import the app once in the gunicorn master, before forking the workers")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    bench([int(w) for w in args.workers.split(",")], args.clients, args.seconds, args.preload)
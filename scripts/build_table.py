@@ -1,165 +1,333 @@
 import pandas as pd
 import numpy as np
-import re
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from strategy import calculate_signals
+from strategy import RULES, calculate_signals
+from indicators import (
+    MA_WINDOWS, VOLUME_MA_WINDOW,
+    segment_positions, segment_ids, group_shift, group_rolling_mean, kd_columns, macd_columns,
+)
+from indicator_state import IndicatorState, STATE_FILE
+from signal_events import SignalEvents, EVENTS_FILE
+from summary_snapshots import SummarySnapshots, SNAPSHOT_FILE, SNAPSHOT_INDEX_FILE
+from chart_data import ChartData, CHART_FILE, CHART_INDEX_FILE
+from daily_table import DAILY_FILE, read_daily, write_daily, append_daily, daily_dtypes
+from quotes import quote_frame, QUOTES_DIR as QUOTES_DIRNAME
+from trading_calendar import TradingCalendar
 
 # =========================
 # Config
 # =========================
 RAW_DIR = Path("data/raw")
+QUOTES_DIR = Path("data") / QUOTES_DIRNAME
 OUT_DIR = Path("data/processed")
-OUT_DIR.mkdir(exist_ok=True)
 
-OUT_FILE_DAILY_PARQUET = OUT_DIR / "daily.parquet"
+OUT_FILE_DAILY_PARQUET = DAILY_FILE
 OUT_FILE_SUMMARY_PARQUET = OUT_DIR / "summary.parquet"
-
-# define patterns
-STOCK_PATTERN = re.compile(r"^\d{4}$")     # 2330
-ETF_PATTERN   = re.compile(r"^00\d{2,3}$") # 0050, 00878
+OUT_FILE_STATE = STATE_FILE
+OUT_FILE_EVENTS = EVENTS_FILE
+OUT_FILE_SNAPSHOTS = SNAPSHOT_FILE
+OUT_FILE_SNAPSHOT_INDEX = SNAPSHOT_INDEX_FILE
+OUT_FILE_CHART = CHART_FILE
+OUT_FILE_CHART_INDEX = CHART_INDEX_FILE
+OUT_FILE_BUILD_STATE = OUT_DIR / "build_state.json"
+
+# bump when the columns of daily.parquet or the state layout change; an
+# incremental build over outputs of another version (or other strategy
+# rules) falls back to a full rebuild
+BUILD_VERSION = 4
+
+# processes that read and clean day files; 1 parses in this process
+BUILD_WORKERS = os.cpu_count() or 1
 
 # =========================
 # Helpers
 # =========================
-def is_stock_or_etf(code: str) -> bool:
-    if not isinstance(code, str):
-        return False
-    return bool(STOCK_PATTERN.match(code) or ETF_PATTERN.match(code))
-
-def clean_numeric(s):
-    return pd.to_numeric(
-        s.astype(str)
-         .str.replace(",", "", regex=False)
-         .str.replace(r"<.*?>", "", regex=True)
-         .replace(["--", "", "nan"], pd.NA),
-        errors="coerce"
-    )
-
-def add_ma_features(df):
-    df["MA5"]  = df["close"].rolling(5).mean()
-    df["MA10"] = df["close"].rolling(10).mean()
-    df["MA20"] = df["close"].rolling(20).mean()
-    return df
-
-def add_kd_features(df, n=9):
-    low_n  = df["low"].rolling(n, min_periods=1).min()
-    high_n = df["high"].rolling(n, min_periods=1).max()
-
-    denom = (high_n - low_n).replace(0, np.nan)
-    rsv = 100 * (df["close"] - low_n) / denom
-
-    df["K"] = rsv.ewm(alpha=1/3, adjust=False).mean().round(2)
-    df["D"] = df["K"].ewm(alpha=1/3, adjust=False).mean().round(2)
-    return df
-
-def add_macd_features(df, fast=12, slow=26, signal=9):
-    ema_fast = df["close"].ewm(span=fast, adjust=False).mean()
-    ema_slow = df["close"].ewm(span=slow, adjust=False).mean()
-
-    df["DIF"] = (ema_fast - ema_slow).round(2)
-    df["MACD"] = df["DIF"].ewm(span=signal, adjust=False).mean().round(2)
-    df["MACD_hist"] = df["DIF"] - df["MACD"]
-    return df
-
-# =========================
-# Main
-# =========================
-all_rows = []
-
-for day_dir in sorted(RAW_DIR.iterdir()):
-    if not day_dir.is_dir():
-        continue
+def day_sources():
+    """Map YYYYMMDD → quote Parquet file, falling back to the raw CSV folder."""
+    sources = {}
+    if RAW_DIR.exists():
+        for day_dir in RAW_DIR.iterdir():
+            if day_dir.is_dir():
+                sources[day_dir.name] = day_dir
+    if QUOTES_DIR.exists():
+        for path in QUOTES_DIR.glob("*.parquet"):
+            sources[path.stem] = path
+    return dict(sorted(sources.items()))
+
+def load_day(date_str, source):
+    if source.suffix == ".parquet":
+        return pd.read_parquet(source)
 
-    date_str = day_dir.name  # YYYYMMDD
     year, month, day = int(date_str[:4]), int(date_str[4:6]), int(date_str[6:])
     csv_filename = f"{year-1911}年{month:02d}月{day:02d}日 每日收盤行情(全部).csv"
-    csv_path = day_dir / csv_filename
+    csv_path = source / csv_filename
 
     if not csv_path.exists():
-        continue
-
-    print(f"Processing {date_str}")
-
-    df = pd.read_csv(csv_path, dtype=str)
-
-    required_cols = [
-        "證券代號",
-        "證券名稱",
-        "開盤價",
-        "最高價",
-        "最低價",
-        "收盤價",
-        "成交股數",
-    ]
-
-    missing = set(required_cols) - set(df.columns)
-    if missing:
-        print(f"  Skip {date_str}, missing columns: {missing}")
-        continue
-
-    # filter by stock or etf
-    df = df[df["證券代號"].apply(is_stock_or_etf)].copy()
-
-    # clean
-    df["open"]   = clean_numeric(df["開盤價"])
-    df["high"]   = clean_numeric(df["最高價"])
-    df["low"]    = clean_numeric(df["最低價"])
-    df["close"]  = clean_numeric(df["收盤價"])
-    df["volume"] = (clean_numeric(df["成交股數"]) / 1000).round(2)
-
-    # add date
-    df["date"] = pd.to_datetime(date_str)
-    df["stock_id"] = df["證券代號"]
-    df["stock_name"] = df["證券名稱"]
-
-    df = df[[
-        "date",
-        "stock_id",
-        "stock_name",
-        "open",
-        "high",
-        "low",
-        "close",
-        "volume",
-    ]]
-
-    all_rows.append(df)
-
-# Concat & Save
-if not all_rows:
-    raise RuntimeError("No valid trading data found.")
-
-final_df = (
-    pd.concat(all_rows, ignore_index=True)
-    .sort_values(["stock_id", "date"])
-    .groupby("stock_id", group_keys=False)
-    .apply(add_ma_features)
-    .pipe(lambda d: d.groupby("stock_id", group_keys=False).apply(add_kd_features))
-    .pipe(lambda d: d.groupby("stock_id", group_keys=False).apply(add_macd_features))
-)
+        return None
+
+    return quote_frame(pd.read_csv(csv_path, dtype=str), date_str)
+
+def source_mtime(source):
+    """Last change of a day's quote file (or of any file in its CSV folder)."""
+    if source.is_dir():
+        return max((path.stat().st_mtime_ns for path in source.iterdir()), default=source.stat().st_mtime_ns)
+    return source.stat().st_mtime_ns
+
+def compute_indicators(base_df: pd.DataFrame, states=None) -> pd.DataFrame:
+    """MA / KD / MACD and change ratios for every stock in one pass over the sorted frame.
+
+    If `states` is given, every stock's EWM seeds after its last row are
+    written to it (stock_id → {name: seed}) for IndicatorState.from_build.
+    """
+    df = base_df.sort_values(["stock_id", "date"]).copy()
+    keys = df["stock_id"].to_numpy()
+    pos = segment_positions(keys)
+    groups = segment_ids(pos)
+    close = df["close"].to_numpy(dtype=np.float64)
+    volume = df["volume"].to_numpy(dtype=np.float64)
+
+    # MA
+    for window in MA_WINDOWS:
+        df[f"MA{window}"] = group_rolling_mean(close, pos, window)
+
+    # KD
+    df["K"], df["D"], kd_seeds = kd_columns(
+        df["low"].to_numpy(dtype=np.float64), df["high"].to_numpy(dtype=np.float64), close, pos, groups
+    )
+
+    # MACD
+    df["DIF"], df["MACD"], df["MACD_hist"], macd_seeds = macd_columns(close, groups)
+    seeds = {**kd_seeds, **macd_seeds}
 
-# Add other indicators
-final_df['close_change_pct'] = (
-    final_df.groupby("stock_id")["close"]
-    .pct_change() * 100
-).round(2)
+    # Add other indicators
+    df['close_change_pct'] = (
+        df["close"].groupby(groups, sort=False)
+        .pct_change() * 100
+    ).round(2)
 
-final_df['close_3d_change_pct'] = (
-    final_df.groupby("stock_id")["close"]
-    .transform(lambda x: (x - x.shift(3)) / x.shift(3) * 100)
-).round(2)
+    close_3d = group_shift(close, pos, 3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df['close_3d_change_pct'] = ((close - close_3d) / close_3d * 100).round(2)
 
-final_df['vol_ma5'] = final_df.groupby("stock_id")["volume"].transform(lambda x: x.rolling(5).mean())
-final_df['volume_ratio_5d'] = (final_df['volume'] / final_df['vol_ma5']).round(2)
+    df['vol_ma5'] = group_rolling_mean(volume, pos, VOLUME_MA_WINDOW)
+    df['volume_ratio_5d'] = (df['volume'] / df['vol_ma5']).round(2)
 
-# Add signals
-final_df = final_df.groupby("stock_id", group_keys=False).apply(calculate_signals)
+    if states is not None:
+        stock_ids = keys[pos == 0]
+        for name, (weighted, pending) in seeds.items():
+            for i, stock_id in enumerate(stock_ids):
+                states.setdefault(stock_id, {})[name] = (weighted[i], pending[i])
 
-summary_df = final_df.groupby("stock_id").tail(1).copy()
+    return df
 
-final_df.to_parquet(OUT_FILE_DAILY_PARQUET, index=False)
-summary_df.to_parquet(OUT_FILE_SUMMARY_PARQUET, index=False)
+def add_indicators(base_df: pd.DataFrame, states=None) -> pd.DataFrame:
+    """Compute MA / KD / MACD, change ratios and signals for daily quotes of any set of stocks."""
+    final_df = compute_indicators(base_df, states)
+
+    # Add signals
+    return calculate_signals(final_df)
+
+def load_build_state():
+    """Days in the processed data and days skipped as unreadable (with their file's mtime), or None."""
+    if not OUT_FILE_BUILD_STATE.exists():
+        return None
+    with open(OUT_FILE_BUILD_STATE, encoding="utf-8") as f:
+        build_state = json.load(f)
+    if build_state.get("version") != BUILD_VERSION:
+        print("Processed data is from an older build, rebuilding everything")
+        return None
+    if build_state.get("rules") != RULES.digest:
+        print("Strategy rules changed, rebuilding everything")
+        return None
+    build_state.setdefault("skipped", {})
+    return build_state
+
+def pending_days(sources, build_state):
+    """Days not built yet; a skipped day comes back once its file changes."""
+    built, skipped = set(build_state["days"]), build_state["skipped"]
+    return [d for d in sources if d not in built and skipped.get(d) != source_mtime(sources[d])]
+
+def save_outputs(final_df: pd.DataFrame, state=None, days=None, skipped=None):
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    summary_df = final_df.groupby("stock_id").tail(1).copy()
+
+    write_daily(final_df, OUT_FILE_DAILY_PARQUET)
+    summary_df.to_parquet(OUT_FILE_SUMMARY_PARQUET, index=False)
+    # precomputed for the dashboard, so it starts without reading daily.parquet
+    ChartData.from_daily(final_df).save(OUT_FILE_CHART, OUT_FILE_CHART_INDEX)
+    SummarySnapshots.from_daily(final_df).save(OUT_FILE_SNAPSHOTS, OUT_FILE_SNAPSHOT_INDEX)
+    SignalEvents.from_daily(final_df).save(OUT_FILE_EVENTS)
+    save_build_state(state, days, skipped)
+
+    print(f"Successfully saved {OUT_FILE_DAILY_PARQUET}")
+    print(f"Successfully saved {OUT_FILE_SUMMARY_PARQUET}")
+    print(f"Successfully saved {OUT_FILE_CHART}")
+    print(f"Successfully saved {OUT_FILE_SNAPSHOTS}")
+    print(f"Successfully saved {OUT_FILE_EVENTS}")
+
+def append_outputs(new_days, state, days, skipped):
+    """Add the rows of new days (date → frame, after every saved day) without reading the saved history.
+
+    Each day becomes its own file under daily.parquet; the summary, chart,
+    snapshot and event files are extended from their saved versions.
+    """
+    new_df = pd.concat(new_days.values(), ignore_index=True)
+    for date_str, day_df in new_days.items():
+        append_daily(day_df, date_str, OUT_FILE_DAILY_PARQUET)
+
+    summary_df = pd.concat([pd.read_parquet(OUT_FILE_SUMMARY_PARQUET), new_df], ignore_index=True)
+    summary_df = summary_df.sort_values(["stock_id", "date"], kind="stable").groupby("stock_id").tail(1)
+    summary_df.to_parquet(OUT_FILE_SUMMARY_PARQUET, index=False)
+    ChartData.open(OUT_FILE_CHART, OUT_FILE_CHART_INDEX).extend(new_df).save(OUT_FILE_CHART, OUT_FILE_CHART_INDEX)
+    SummarySnapshots.load(OUT_FILE_SNAPSHOTS, OUT_FILE_SNAPSHOT_INDEX).extend(new_df).save(OUT_FILE_SNAPSHOTS, OUT_FILE_SNAPSHOT_INDEX)
+    SignalEvents.load(OUT_FILE_EVENTS).extend(new_df).save(OUT_FILE_EVENTS)
+    save_build_state(state, days, skipped)
+
+    print(f"Successfully appended {len(new_days)} days to {OUT_FILE_DAILY_PARQUET}")
+    print(f"Successfully updated {OUT_FILE_SUMMARY_PARQUET}, {OUT_FILE_CHART}, {OUT_FILE_SNAPSHOTS}, {OUT_FILE_EVENTS}")
+
+def save_build_state(state=None, days=None, skipped=None):
+    if state is not None:
+        state.save(OUT_FILE_STATE)
+    if days is not None:
+        with open(OUT_FILE_BUILD_STATE, "w", encoding="utf-8") as f:
+            json.dump({"version": BUILD_VERSION, "rules": RULES.digest, "days": sorted(days), "skipped": skipped or {}}, f)
+
+def parse_day(item):
+    """load_day for a process pool: returns (date_str, frame or None, skip reason or None)."""
+    date_str, source = item
+    try:
+        return date_str, load_day(date_str, source), None
+    except ValueError as e:
+        return date_str, None, str(e)
+
+def load_days(sources, calendar, workers=BUILD_WORKERS):
+    items = list(sources.items())
+    if workers > 1 and len(items) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(items)))
+        chunksize = max(1, len(items) // (workers * 4))
+        results = executor.map(parse_day, items, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(parse_day, items)
+
+    frames = {}
+    try:
+        # map() keeps date order, so the frames concatenate exactly as a serial run
+        for date_str, df, error in results:
+            print(f"Processing {date_str}")
+
+            if error is not None:
+                print(f"  Skip {date_str}, {error}")
+                continue
+
+            if df is None:
+                continue
+
+            frames[date_str] = df
+            calendar.mark_trading(date_str)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return frames
+
+def skipped_days(sources, frames):
+    """Days of `sources` that load_days returned no frame for, with their file's mtime."""
+    return {d: source_mtime(source) for d, source in sources.items() if d not in frames}
+
+def build_full(sources, calendar, workers=BUILD_WORKERS):
+    frames = load_days(sources, calendar, workers)
+
+    # Concat & Save
+    if not frames:
+        raise RuntimeError("No valid trading data found.")
+
+    seeds = {}
+    final_df = add_indicators(pd.concat(frames.values(), ignore_index=True), seeds)
+    save_outputs(final_df, IndicatorState.from_build(final_df, seeds), frames, skipped_days(sources, frames))
+    return final_df
+
+def build_incremental(sources, new_days, build_state, calendar, workers=BUILD_WORKERS):
+    """Append new trading days to daily.parquet by advancing the saved indicator state one day at a time.
+
+    Only the new days are read and written; returns their rows (date → frame).
+    """
+    new_sources = {d: sources[d] for d in new_days}
+    frames = load_days(new_sources, calendar, workers)
+    dtypes = daily_dtypes(OUT_FILE_DAILY_PARQUET)
+    state = IndicatorState.load(OUT_FILE_STATE)
+
+    built = {}
+    for date_str, day_df in frames.items():
+        t0 = time.perf_counter()
+        built[date_str] = (
+            state.advance(day_df)[dtypes.index]
+            .astype(dtypes.to_dict())
+            .sort_values("stock_id", kind="stable")
+            .reset_index(drop=True)
+        )
+        print(f"  {len(day_df)} stocks advanced in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    skipped = {d: mtime for d, mtime in build_state["skipped"].items() if d not in new_sources}
+    skipped.update(skipped_days(new_sources, frames))
+    days = [*build_state["days"], *frames]
+    if built:
+        print(f"Appending {sum(len(df) for df in built.values())} rows for {len(built)} new days")
+        append_outputs(built, state, days, skipped)
+    else:
+        save_build_state(None, days, skipped)
+    return built
 
-print(f"Successfully saved {OUT_FILE_DAILY_PARQUET}")
-print(f"Successfully saved {OUT_FILE_SUMMARY_PARQUET}")
\ No newline at end of file
+# =========================
+# Main
+# =========================
+def main(incremental=False, verify=False, workers=BUILD_WORKERS):
+    calendar = TradingCalendar()
+    sources = day_sources()
+    build_state = load_build_state() if incremental else None
+    appended = None
+    up_to_date = False
+
+    if build_state is not None and OUT_FILE_DAILY_PARQUET.exists() and OUT_FILE_STATE.exists():
+        built = set(build_state["days"])
+        new_days = pending_days(sources, build_state)
+
+        if not new_days:
+            print("No new trading days")
+            up_to_date = True
+        # a day older than the last build (backfill, repair) changes history → full rebuild
+        elif not built or new_days[0] > max(built):
+            appended = build_incremental(sources, new_days, build_state, calendar, workers)
+        else:
+            print(f"{new_days[0]} is older than the last build, rebuilding everything")
+
+    if appended is None and not up_to_date:
+        build_full(sources, calendar, workers)
+    elif appended is not None and verify:
+        full_df = add_indicators(pd.concat(load_days(sources, calendar, workers).values(), ignore_index=True))
+        pd.testing.assert_frame_equal(
+            read_daily(OUT_FILE_DAILY_PARQUET), full_df.reset_index(drop=True), check_exact=True
+        )
+        print("Incremental build is identical to a full rebuild")
+
+    calendar.save()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build daily / summary tables from raw quotes.")
+    parser.add_argument("--incremental", action="store_true", help="only process days added since the last build")
+    parser.add_argument("--verify", action="store_true", help="compare an incremental build with a full rebuild")
+    parser.add_argument("--workers", type=int, default=BUILD_WORKERS, help="processes parsing day files in parallel")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(incremental=args.incremental, verify=args.verify, workers=args.workers)
@@ -0,0 +1,164 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# =========================
+# Config
+# =========================
+CHART_FILE = Path("data/processed/chart.arrow")
+CHART_INDEX_FILE = Path("data/processed/chart_index.npz")
+DAILY_FILE = Path("data/processed/daily.parquet")
+
+# the columns the chart tab draws
+CHART_COLUMNS = ["date", "open", "high", "low", "close", "MA5", "MA10", "MA20", "K", "D", "DIF", "MACD", "MACD_hist"]
+
+
+# =========================
+# Chart data
+# =========================
+class ChartData:
+    """The chart columns of every stock, read from a memory-mapped Arrow file.
+
+    build_table writes the rows sorted by stock_id / date, one record batch,
+    NaN kept as NaN, so each column maps to a NumPy array without a copy and
+    only the pages a chart touches are read. The small index next to it holds
+    the stocks (with their names and row offsets) and the trading dates, so
+    opening the data does not depend on the length of the history.
+    """
+
+    def __init__(self, table, stock_ids, stock_names, offsets, dates):
+        self.table = table
+        self.stock_ids = stock_ids
+        self.stock_names = stock_names
+        self.offsets = offsets
+        self.dates = dates
+        self.position = {stock_id: i for i, stock_id in enumerate(stock_ids.tolist())}
+        self._columns = {}
+
+    # ---------- construction ----------
+    @classmethod
+    def from_daily(cls, daily: pd.DataFrame):
+        daily = daily.sort_values(["stock_id", "date"], kind="stable")
+        table = pa.table({
+            col: pa.array(daily[col].to_numpy(dtype="datetime64[ns]" if col == "date" else np.float64))
+            for col in CHART_COLUMNS
+        })
+
+        stock_values = daily["stock_id"].to_numpy().astype("U8")
+        starts = np.flatnonzero(np.r_[True, stock_values[1:] != stock_values[:-1]]) if len(daily) else np.array([], dtype=np.int64)
+        return cls(
+            table,
+            stock_values[starts],
+            daily["stock_name"].to_numpy().astype(str)[starts],
+            np.r_[starts, len(daily)],
+            np.unique(daily["date"].to_numpy(dtype="datetime64[ns]")),
+        )
+
+    def extend(self, new_rows: pd.DataFrame):
+        """Chart data with the rows of days after the last one inserted at the end of each stock's range."""
+        new_rows = new_rows.sort_values(["stock_id", "date"], kind="stable")
+        new_ids = new_rows["stock_id"].to_numpy().astype("U8")
+
+        # a stock's new rows go at the end of its range; a new stock's at the start of the next stock
+        at = self.offsets[np.searchsorted(self.stock_ids, new_ids, side="right")]
+        table = pa.table({
+            col: pa.array(np.insert(
+                self.column(col),
+                at,
+                new_rows[col].to_numpy(dtype="datetime64[ns]" if col == "date" else np.float64),
+            ))
+            for col in CHART_COLUMNS
+        })
+
+        stock_ids, first = np.unique(np.r_[self.stock_ids, new_ids], return_index=True)
+        names = np.r_[self.stock_names, new_rows["stock_name"].to_numpy().astype(str)]
+        counts = np.bincount(np.searchsorted(stock_ids, self.stock_ids), weights=np.diff(self.offsets), minlength=len(stock_ids))
+        counts += np.bincount(np.searchsorted(stock_ids, new_ids), minlength=len(stock_ids))
+        return ChartData(
+            table,
+            stock_ids,
+            names[first],
+            np.r_[0, np.cumsum(counts.astype(np.int64))],
+            np.union1d(self.dates, new_rows["date"].to_numpy(dtype="datetime64[ns]")),
+        )
+
+    @classmethod
+    def open(cls, path=CHART_FILE, index_path=CHART_INDEX_FILE):
+        table = open_arrow(path)
+        with np.load(index_path, allow_pickle=False) as f:
+            index = {key: f[key] for key in f.files}
+        if table.column_names != CHART_COLUMNS or index["offsets"][-1] != table.num_rows:
+            raise ValueError(f"{path} does not match {index_path}")
+        return cls(table, index["stock_id"], index["stock_name"], index["offsets"], index["dates"])
+
+    def save(self, path=CHART_FILE, index_path=CHART_INDEX_FILE):
+        """Write both files under temporary names first, so readers never see half a build."""
+        path, index_path = Path(path), Path(index_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp = write_arrow(self.table, path)
+        tmp_index = index_path.with_suffix(".tmp.npz")
+        with open(tmp_index, "wb") as f:
+            np.savez(f, stock_id=self.stock_ids, stock_name=self.stock_names, offsets=self.offsets, dates=self.dates)
+
+        os.replace(tmp, path)
+        os.replace(tmp_index, index_path)
+
+    # ---------- lookups ----------
+    def column(self, name):
+        if name not in self._columns:
+            values = self.table.column(name)
+            values = values.chunk(0) if values.num_chunks == 1 else values.combine_chunks()
+            self._columns[name] = values.to_numpy(zero_copy_only=False)
+        return self._columns[name]
+
+    def rows(self, stock_id, start=None, end=None):
+        """Row range of one stock, optionally limited to dates start..end; None for an unknown stock."""
+        i = self.position.get(stock_id)
+        if i is None:
+            return None
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        dates = self.column("date")[lo:hi]
+        first = lo if start is None else lo + dates.searchsorted(np.datetime64(start), side="left")
+        last = hi if end is None else lo + dates.searchsorted(np.datetime64(end), side="right")
+        return slice(int(first), int(last))
+
+    def frame(self, rows, columns=CHART_COLUMNS):
+        return pd.DataFrame({col: self.column(col)[rows] for col in columns})
+
+    def date_bounds(self, stock_id):
+        i = self.position[stock_id]
+        dates = self.column("date")
+        return pd.Timestamp(dates[self.offsets[i]]), pd.Timestamp(dates[self.offsets[i + 1] - 1])
+
+    def bounds_seconds(self):
+        """stock_id → [first, last] date in Unix seconds, as the sliders use them."""
+        dates = self.column("date")
+        first = dates[self.offsets[:-1]].astype("datetime64[s]").astype(np.int64)
+        last = dates[self.offsets[1:] - 1].astype("datetime64[s]").astype(np.int64)
+        return {stock_id: [int(a), int(b)] for stock_id, a, b in zip(self.stock_ids.tolist(), first, last)}
+
+
+def write_arrow(table, path):
+    """Write `table` as one record batch to a temporary file next to `path`; returns it for os.replace."""
+    tmp = Path(path).with_suffix(".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    return tmp
+
+def open_arrow(path):
+    """Memory-mapped table: columns are read from the page cache as they are used."""
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+def load_chart_data(daily_file=None, path=CHART_FILE, index_path=CHART_INDEX_FILE):
+    """The built chart data, or chart data read from `daily_file` when the files are missing or stale."""
+    try:
+        return ChartData.open(path, index_path)
+    except (FileNotFoundError, ValueError) as e:
+        if daily_file is None:
+            raise
+        print(f"Reading chart data from {daily_file} ({e})")
+        return ChartData.from_daily(pd.read_parquet(daily_file, columns=["stock_id", "stock_name", *CHART_COLUMNS]))
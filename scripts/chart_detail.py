@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+# =========================
+# Config
+# =========================
+# bar size for a visible span: the first level whose span (calendar days)
+# covers it; a figure holds its level's span around the visible range, so
+# the daily and weekly charts stay near 1,000 bars whatever the history
+DETAIL_LEVELS = [("D", 730), ("W", 3650), ("M", None)]
+# half a bar, in days: the margin left around the first and last visible bar
+HALF_BAR_DAYS = {"D": 0.5, "W": 3.5, "M": 15}
+# indicator lines of weekly / monthly charts keep this many points per bar
+LINE_POINTS_PER_BAR = 2
+
+BAR_COLUMNS = ["date", "open", "high", "low", "close", "MACD_hist"]
+
+
+# =========================
+# Level of detail
+# =========================
+def detail_level(start, end):
+    span = (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(days=1)
+    for level, max_span in DETAIL_LEVELS:
+        if max_span is None or span <= max_span:
+            return level
+
+def detail_window(level, start, end):
+    """Dates a figure of `level` covers to show start..end: half the level's span on either side,
+    widened to whole months so nearby ranges share a figure. (None, None) is the whole history."""
+    max_span = dict(DETAIL_LEVELS)[level]
+    if max_span is None:
+        return None, None
+    pad = pd.Timedelta(days=max_span // 2)
+    first = (pd.Timestamp(start) - pad).to_period("M").start_time
+    last = (pd.Timestamp(end) + pad).to_period("M").end_time.normalize() + pd.Timedelta(days=1)
+    return first, last
+
+def period_keys(dates, level):
+    """Week (Monday to Sunday) or month number of each date."""
+    days = dates.astype("datetime64[D]").astype(np.int64)
+    if level == "W":
+        # 1970-01-01 was a Thursday
+        return (days + 3) // 7
+    return dates.astype("datetime64[M]").astype(np.int64)
+
+
+# =========================
+# Bars and lines
+# =========================
+def aggregate_bars(frame, level):
+    """OHLC bars of a date-sorted daily frame, one per week or month, dated on its last trading day."""
+    if level == "D" or frame.empty:
+        return frame[BAR_COLUMNS].reset_index(drop=True)
+
+    keys = period_keys(frame["date"].to_numpy(), level)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(frame)] - 1
+    return pd.DataFrame({
+        "date": frame["date"].to_numpy()[ends],
+        "open": frame["open"].to_numpy()[starts],
+        "high": np.fmax.reduceat(frame["high"].to_numpy(), starts),
+        "low": np.fmin.reduceat(frame["low"].to_numpy(), starts),
+        "close": frame["close"].to_numpy()[ends],
+        # the histogram of the period's last day: MACD as a weekly / monthly chart would show it
+        "MACD_hist": frame["MACD_hist"].to_numpy()[ends],
+    })
+
+def lttb(x, y, n):
+    """Indices of the n points Largest-Triangle-Three-Buckets keeps of the line x, y (no NaN)."""
+    if n >= len(x) or n < 3:
+        return np.arange(len(x))
+
+    # inner points are split into n - 2 buckets; each keeps the point spanning the largest
+    # triangle with the point kept before it and the mean of the next bucket
+    edges = np.linspace(1, len(x) - 1, n - 1).astype(np.int64)
+    keep = np.empty(n, dtype=np.int64)
+    keep[0], keep[-1] = 0, len(x) - 1
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < n - 1:
+            next_x, next_y = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        ax, ay = x[keep[i]], y[keep[i]]
+        area = np.abs((ax - next_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y - ay))
+        keep[i + 1] = lo + int(np.argmax(area))
+    return keep
+
+def downsample_line(dates, values, n):
+    """Dates and values of a daily line reduced to about n points (leading NaN dropped)."""
+    valid = ~np.isnan(values)
+    dates, values = dates[valid], values[valid]
+    keep = lttb(dates.astype(np.int64).astype(np.float64), values, n)
+    return dates[keep], values[keep]
+
+def level_series(frame, level, line_columns):
+    """Bars and indicator lines of a date-sorted daily frame at one level of detail.
+
+    Daily lines share the bars' dates; weekly / monthly lines are LTTB samples
+    of the daily line, so peaks between bar dates are kept.
+    """
+    bars = aggregate_bars(frame, level)
+    dates = frame["date"].to_numpy()
+    lines = {}
+    for col in line_columns:
+        values = frame[col].to_numpy(dtype=np.float64)
+        if level == "D":
+            lines[col] = (dates, values)
+        else:
+            lines[col] = downsample_line(dates, values, len(bars) * LINE_POINTS_PER_BAR)
+    return bars, lines
@@ -0,0 +1,76 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+# =========================
+# Config
+# =========================
+DAILY_FILE = Path("data/processed/daily.parquet")
+
+# daily.parquet is a folder: the rows of the last full build sorted by
+# stock_id / date, plus one file per day an incremental build appended
+BASE_PART = "base.parquet"
+DAY_PART_PREFIX = "day-"
+# appended day files are folded into the base file once there are this many
+MAX_DAY_PARTS = 60
+
+
+# =========================
+# Daily table
+# =========================
+def day_parts(path=DAILY_FILE):
+    return sorted(Path(path).glob(f"{DAY_PART_PREFIX}*.parquet"))
+
+def daily_dtypes(path=DAILY_FILE):
+    """Columns of the table (in order) with their pandas dtypes, read from the base file's schema only."""
+    return pq.read_schema(Path(path) / BASE_PART).empty_table().to_pandas().dtypes
+
+def read_daily(path=DAILY_FILE, columns=None):
+    """The table sorted by stock_id / date, appended days merged into the base rows."""
+    path = Path(path)
+    if path.is_file() or not day_parts(path):
+        return pd.read_parquet(path, columns=columns)
+
+    keys = [col for col in ("stock_id", "date") if columns is not None and col not in columns]
+    df = (
+        pd.read_parquet(path, columns=None if columns is None else [*columns, *keys])
+        .sort_values(["stock_id", "date"], kind="stable")
+        .reset_index(drop=True)
+    )
+    return df.drop(columns=keys) if keys else df
+
+def write_daily(df: pd.DataFrame, path=DAILY_FILE):
+    """Replace the table by `df` (sorted by stock_id / date) as a single base file."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    old = path.with_name(path.name + ".old")
+    for stale in (tmp, old):
+        remove_path(stale)
+
+    tmp.mkdir(parents=True)
+    df.to_parquet(tmp / BASE_PART, index=False)
+    if path.exists():
+        path.rename(old)
+    tmp.rename(path)
+    remove_path(old)
+
+def append_daily(day_df: pd.DataFrame, date_str, path=DAILY_FILE):
+    """Add one day's rows as their own file; folds the day files into the base file every MAX_DAY_PARTS days."""
+    path = Path(path)
+    part = path / f"{DAY_PART_PREFIX}{date_str}.parquet"
+    # a leading dot keeps a leftover temporary file out of the dataset readers
+    tmp = path / f".{part.name}.tmp"
+    day_df.to_parquet(tmp, index=False)
+    tmp.replace(part)
+
+    if len(day_parts(path)) >= MAX_DAY_PARTS:
+        print(f"Folding {MAX_DAY_PARTS} appended days into {path / BASE_PART}")
+        write_daily(read_daily(path), path)
+
+def remove_path(path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
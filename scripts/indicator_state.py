@@ -0,0 +1,226 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from indicators import (
+    MA_WINDOWS, VOLUME_MA_WINDOW, KD_N, KD_ALPHA, MACD_FAST, MACD_SLOW, MACD_SIGNAL,
+    ewm_alpha, ewm_step, window_mean,
+)
+from strategy import RULES, signal_codes, signal_labels
+
+# =========================
+# Config
+# =========================
+STATE_FILE = Path("data/processed/indicator_state.npz")
+
+EWM_ALPHAS = {
+    "K": ewm_alpha(alpha=KD_ALPHA),
+    "D": ewm_alpha(alpha=KD_ALPHA),
+    "ema_fast": ewm_alpha(span=MACD_FAST),
+    "ema_slow": ewm_alpha(span=MACD_SLOW),
+    "MACD": ewm_alpha(span=MACD_SIGNAL),
+}
+
+# ring buffers, oldest value first
+BUFFERS = {
+    "close": max(MA_WINDOWS),
+    "low": KD_N,
+    "high": KD_N,
+    "volume": VOLUME_MA_WINDOW,
+}
+
+
+# =========================
+# Indicator state
+# =========================
+class IndicatorState:
+    """Per-stock state that is enough to compute each stock's next row.
+
+    Everything is a NumPy array indexed like `stock_id` (kept sorted): the
+    rolling-window buffers, the EWM seeds (weighted value and rows since the
+    last observation), the last valid close used by pct_change's forward
+    fill, yesterday's value of every prev_<column> the rules use, and the
+    rules' counters (-1 until their signal first fires). advance() moves
+    every stock that traded on a day forward in one vectorized step.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays["stock_id"])
+
+    # ---------- construction ----------
+    @classmethod
+    def empty(cls, n=0):
+        arrays = {
+            "stock_id": np.empty(n, dtype="U8"),
+            "rows": np.zeros(n, dtype=np.int64),
+            "last_date": np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]"),
+            "last_valid_close": np.full(n, np.nan),
+        }
+        for col in RULES.prev_columns:
+            arrays[f"prev_{col}"] = np.full(n, np.nan)
+        for name in RULES.counters:
+            arrays[name] = np.full(n, -1, dtype=np.int64)
+        for col, width in BUFFERS.items():
+            arrays[f"{col}_buf"] = np.full((n, width), np.nan)
+        for name in EWM_ALPHAS:
+            arrays[f"{name}_weighted"] = np.full(n, np.nan)
+            arrays[f"{name}_pending"] = np.zeros(n, dtype=np.int64)
+        return cls(arrays)
+
+    @classmethod
+    def from_build(cls, daily: pd.DataFrame, seeds):
+        """Snapshot after a build: `daily` sorted by stock_id / date, `seeds` from add_indicators."""
+        last = daily.drop_duplicates("stock_id", keep="last")
+        state = cls.empty(len(last))
+        a = state.arrays
+
+        a["stock_id"] = last["stock_id"].to_numpy().astype("U8")
+        a["last_date"] = last["date"].to_numpy(dtype="datetime64[ns]")
+        for col in RULES.prev_columns:
+            a[f"prev_{col}"] = last[col].to_numpy(dtype=np.float64)
+        for name, (source, _) in RULES.counters.items():
+            fired = daily.groupby("stock_id", sort=False)[source].any().to_numpy()
+            a[name] = np.where(fired, last[name].to_numpy(dtype=np.int64), -1)
+
+        row_idx = np.searchsorted(a["stock_id"], daily["stock_id"].to_numpy().astype("U8"))
+        a["rows"] = np.bincount(row_idx, minlength=len(state)).astype(np.int64)
+        from_end = daily.groupby("stock_id").cumcount(ascending=False).to_numpy()
+
+        for col, width in BUFFERS.items():
+            keep = from_end < width
+            a[f"{col}_buf"][row_idx[keep], width - 1 - from_end[keep]] = daily[col].to_numpy()[keep]
+
+        valid = daily["close"].notna().to_numpy()
+        last_valid = daily.loc[valid].drop_duplicates("stock_id", keep="last")
+        idx = np.searchsorted(a["stock_id"], last_valid["stock_id"].to_numpy().astype("U8"))
+        a["last_valid_close"][idx] = last_valid["close"].to_numpy()
+
+        for i, stock_id in enumerate(a["stock_id"]):
+            for name in EWM_ALPHAS:
+                a[f"{name}_weighted"][i], a[f"{name}_pending"][i] = seeds[stock_id][name]
+
+        return state
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        with np.load(path, allow_pickle=False) as f:
+            return cls({key: f[key] for key in f.files})
+
+    def save(self, path=STATE_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, **self.arrays)
+
+    def ewm_seeds(self):
+        a = self.arrays
+        return {
+            stock_id: {name: (a[f"{name}_weighted"][i], a[f"{name}_pending"][i]) for name in EWM_ALPHAS}
+            for i, stock_id in enumerate(a["stock_id"])
+        }
+
+    def _add_stocks(self, stock_ids):
+        new_ids = np.setdiff1d(stock_ids, self.arrays["stock_id"])
+        if len(new_ids) == 0:
+            return
+
+        added = IndicatorState.empty(len(new_ids))
+        added.arrays["stock_id"] = new_ids
+        merged = {k: np.concatenate([v, added.arrays[k]]) for k, v in self.arrays.items()}
+        order = np.argsort(merged["stock_id"], kind="stable")
+        self.arrays = {k: v[order] for k, v in merged.items()}
+
+    # ---------- one-day update ----------
+    def advance(self, day_df: pd.DataFrame) -> pd.DataFrame:
+        """Compute the daily.parquet rows for one trading day and move the state past it."""
+        stock_ids = day_df["stock_id"].to_numpy().astype("U8")
+        self._add_stocks(stock_ids)
+        idx = np.searchsorted(self.arrays["stock_id"], stock_ids)
+        s = {k: v[idx] for k, v in self.arrays.items()}
+
+        date = day_df["date"].to_numpy(dtype="datetime64[ns]")
+        if (date <= s["last_date"]).any():
+            raise ValueError("advance() called with a day that is already in the state")
+
+        new = {col: day_df[col].to_numpy(dtype=np.float64) for col in BUFFERS}
+        for col in BUFFERS:
+            s[f"{col}_buf"] = np.concatenate([s[f"{col}_buf"][:, 1:], new[col][:, None]], axis=1)
+        close = new["close"]
+
+        row = {
+            "date": date,
+            "stock_id": day_df["stock_id"].to_numpy(),
+            "stock_name": day_df["stock_name"].to_numpy(),
+            "open": day_df["open"].to_numpy(dtype=np.float64),
+            "high": new["high"],
+            "low": new["low"],
+            "close": close,
+            "volume": new["volume"],
+        }
+
+        # MA
+        for window in MA_WINDOWS:
+            row[f"MA{window}"] = window_mean(s["close_buf"][:, -window:])
+
+        # KD
+        with np.errstate(invalid="ignore", divide="ignore"):
+            low_n = np.fmin.reduce(s["low_buf"], axis=1)
+            high_n = np.fmax.reduce(s["high_buf"], axis=1)
+            denom = high_n - low_n
+            denom = np.where(denom == 0, np.nan, denom)
+            rsv = 100 * (close - low_n) / denom
+
+        s["K_weighted"], s["K_pending"] = ewm_step(s["K_weighted"], s["K_pending"], rsv, EWM_ALPHAS["K"])
+        row["K"] = s["K_weighted"].round(2)
+        s["D_weighted"], s["D_pending"] = ewm_step(s["D_weighted"], s["D_pending"], row["K"], EWM_ALPHAS["D"])
+        row["D"] = s["D_weighted"].round(2)
+
+        # MACD
+        for name in ("ema_fast", "ema_slow"):
+            s[f"{name}_weighted"], s[f"{name}_pending"] = ewm_step(
+                s[f"{name}_weighted"], s[f"{name}_pending"], close, EWM_ALPHAS[name]
+            )
+        row["DIF"] = (s["ema_fast_weighted"] - s["ema_slow_weighted"]).round(2)
+        s["MACD_weighted"], s["MACD_pending"] = ewm_step(s["MACD_weighted"], s["MACD_pending"], row["DIF"], EWM_ALPHAS["MACD"])
+        row["MACD"] = s["MACD_weighted"].round(2)
+        row["MACD_hist"] = row["DIF"] - row["MACD"]
+
+        # change ratios (pct_change forward-fills missing closes)
+        filled = np.where(np.isnan(close), s["last_valid_close"], close)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            row["close_change_pct"] = ((filled / s["last_valid_close"] - 1) * 100).round(2)
+            close_3d = s["close_buf"][:, -4]
+            row["close_3d_change_pct"] = ((close - close_3d) / close_3d * 100).round(2)
+            row["vol_ma5"] = window_mean(s["volume_buf"][:, -VOLUME_MA_WINDOW:])
+            row["volume_ratio_5d"] = (new["volume"] / row["vol_ma5"]).round(2)
+        s["last_valid_close"] = filled
+
+        # signals
+        c = {col: row[col] for col in RULES.columns}
+        for col in RULES.prev_columns:
+            c[f"prev_{col}"] = s[f"prev_{col}"]
+
+        def step_counter(name, flags, never):
+            s[name] = np.where(flags, 0, np.where(s[name] < 0, s[name], s[name] + 1))
+            if never is None:
+                # rows since the stock's first row until the signal first fires
+                s[name] = np.where(s[name] < 0, s["rows"], s[name])
+                return s[name]
+            return np.where(s[name] < 0, never, s[name])
+
+        row.update(RULES.evaluate(c, step_counter))
+        row["signal_code"] = signal_codes(row)
+        row["signal_today"] = signal_labels(row["signal_code"])
+
+        for col in RULES.prev_columns:
+            s[f"prev_{col}"] = row[col]
+        s["last_date"] = date
+        s["rows"] = s["rows"] + 1
+
+        for k, v in s.items():
+            self.arrays[k][idx] = v
+
+        return pd.DataFrame(row)
@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# =========================
+# Config
+# =========================
+MA_WINDOWS = (5, 10, 20)
+VOLUME_MA_WINDOW = 5
+KD_N = 9
+KD_ALPHA = 1 / 3
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+
+
+# =========================
+# Kernels
+# =========================
+# The full build (one stock's whole history at a time) and the one-day update
+# in indicator_state (one row of every stock at a time) share these, so both
+# produce exactly the same floats.
+
+def ewm_alpha(alpha=None, span=None):
+    """The alpha pandas actually uses: it converts every parameter to a centre of mass and back."""
+    com = (1 - alpha) / alpha if alpha is not None else (span - 1) / 2
+    return 1. / (1. + com)
+
+
+def window_mean(windows):
+    """Mean of each row of `windows` (oldest value first), from the exactly rounded window sum.
+
+    pandas' rolling mean keeps a running (compensated) sum, so its last bits
+    depend on every earlier row and a one-day update cannot reproduce them.
+    Here each window is summed on its own with an error-free two-sum, the
+    rounding errors are added back once at the end (math.fsum's result), and
+    constant windows return the value itself, as pandas does.
+    """
+    total = windows[:, 0].copy()
+    error = np.zeros(len(total))
+    lo, hi = total.copy(), total.copy()
+    for j in range(1, windows.shape[1]):
+        x = windows[:, j]
+        new_total = total + x
+        x_part = new_total - total
+        error += (total - (new_total - x_part)) + (x - x_part)
+        total = new_total
+        lo = np.minimum(lo, x)
+        hi = np.maximum(hi, x)
+    return np.where(lo == hi, windows[:, 0], (total + error) / windows.shape[1])
+
+
+def ewm_mean(s: pd.Series, **ewm_kwargs):
+    """s.ewm(adjust=False, **ewm_kwargs).mean() plus the seed after its last row.
+
+    A seed is (weighted, pending): the last EWM value and the number of rows
+    since its last observation, which is all ewm_step needs to continue.
+    """
+    values = s.to_numpy(dtype=np.float64)
+    out = s.ewm(adjust=False, **ewm_kwargs).mean()
+
+    observed = np.flatnonzero(~np.isnan(values))
+    if len(observed) == 0:
+        return out, (np.nan, 0)
+    return out, (out.iloc[-1], len(values) - 1 - observed[-1])
+
+
+def ewm_step(weighted, pending, x, alpha):
+    """Advance many ewm(adjust=False) seeds by one row, with pandas' arithmetic.
+
+    pandas multiplies its old weight by (1 - alpha) once per row since the last
+    observation and blends only when the new value differs.
+    """
+    factor = 1. - alpha
+    observed = ~np.isnan(x)
+    started = ~np.isnan(weighted)
+    blend = started & observed
+
+    steps = np.where(blend, pending + 1, 0)
+    old_wt = np.ones(len(x))
+    for i in range(int(steps.max(initial=0))):
+        old_wt = np.where(i < steps, old_wt * factor, old_wt)
+
+    with np.errstate(invalid="ignore"):
+        blended = (old_wt * weighted + alpha * x) / (old_wt + alpha)
+
+    new_weighted = np.where(blend & (weighted != x), blended, weighted)
+    new_weighted = np.where(~started & observed, x, new_weighted)
+    new_pending = np.where(observed, 0, np.where(started, pending + 1, 0))
+    return new_weighted, new_pending
+
+
+# =========================
+# Segmented kernels
+# =========================
+# Whole-frame versions of the kernels above for a frame sorted by stock_id /
+# date: `pos` is each row's position inside its stock, so a window or shift
+# that would reach into the previous stock is masked instead of computed per
+# group.
+
+def segment_positions(keys):
+    """Row number of every row inside its run of equal keys."""
+    keys = np.asarray(keys)
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+    return np.arange(n) - np.repeat(starts, lengths)
+
+def group_shift(values, pos, periods):
+    out = np.full(len(values), np.nan)
+    out[periods:] = values[:-periods]
+    out[pos < periods] = np.nan
+    return out
+
+def group_rolling_mean(values, pos, window):
+    """rolling(window).mean() of every stock (window_mean of each full window, NaN before it)."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = window_mean(sliding_window_view(values, window))
+    out[pos < window - 1] = np.nan
+    return out
+
+def group_rolling_extreme(values, pos, window, ufunc):
+    """rolling(window, min_periods=1).min() / .max() per stock for ufunc np.fmin / np.fmax."""
+    out = values.copy()
+    for k in range(1, window):
+        out = ufunc(out, group_shift(values, pos, k))
+    return out
+
+def segment_ids(pos):
+    """0, 1, 2, ... per stock; cheaper to group by than stock_id strings."""
+    return np.cumsum(pos == 0) - 1
+
+def group_ewm_mean(values, groups, **ewm_kwargs):
+    """ewm_mean applied to every stock (`groups` from segment_ids).
+
+    Returns the EWM column and, per stock in order, the seed after its last
+    row as two arrays (weighted, pending).
+    """
+    out = (
+        pd.Series(values)
+        .groupby(groups, sort=False)
+        .ewm(adjust=False, **ewm_kwargs)
+        .mean()
+        .to_numpy()
+    )
+
+    n = len(values)
+    ends = np.flatnonzero(np.r_[groups[1:] != groups[:-1], True]) if n else np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, ends[:-1] + 1] if n else ends
+
+    last_obs = np.maximum.accumulate(np.where(np.isnan(values), -1, np.arange(n)))
+    last_obs = last_obs[ends]
+    observed = last_obs >= starts
+
+    weighted = np.where(observed, out[ends], np.nan)
+    pending = np.where(observed, ends - last_obs, 0)
+    return out, (weighted, pending)
+
+def kd_columns(low, high, close, pos, groups, n=KD_N):
+    """K and D (rounded like the daily table) plus their EWM seeds."""
+    low_n = group_rolling_extreme(low, pos, n, np.fmin)
+    high_n = group_rolling_extreme(high, pos, n, np.fmax)
+    denom = high_n - low_n
+    denom[denom == 0] = np.nan
+    rsv = 100 * (close - low_n) / denom
+
+    seeds = {}
+    k, seeds["K"] = group_ewm_mean(rsv, groups, alpha=KD_ALPHA)
+    k = k.round(2)
+    d, seeds["D"] = group_ewm_mean(k, groups, alpha=KD_ALPHA)
+    return k, d.round(2), seeds
+
+def macd_columns(close, groups, fast=MACD_FAST, slow=MACD_SLOW, signal=MACD_SIGNAL):
+    """DIF, MACD and MACD_hist (rounded like the daily table) plus the EWM seeds."""
+    seeds = {}
+    ema_fast, seeds["ema_fast"] = group_ewm_mean(close, groups, span=fast)
+    ema_slow, seeds["ema_slow"] = group_ewm_mean(close, groups, span=slow)
+    dif = (ema_fast - ema_slow).round(2)
+    macd, seeds["MACD"] = group_ewm_mean(dif, groups, span=signal)
+    macd = macd.round(2)
+    return dif, macd, dif - macd, seeds
@@ -1,19 +1,40 @@
+import argparse
 import subprocess
 import query_data
 import sys
+import time
 
-def main():
+def update_data():
 
     # Step 1: Download latest data
     print("\n--- Step 1: Checking for new data from TWSE ---")
-    query_data.main() 
+    query_data.main()
 
     # Step 2: Build tables (Process raw CSVs into Parquet)
     print(f"\n--- Step 2: Processing data ---")
-    subprocess.run([sys.executable, "scripts/build_table.py"], check=True)
+    subprocess.run([sys.executable, "scripts/build_table.py", "--incremental"], check=True)
 
-    # Step 3: Launch Dashboard
-    subprocess.run([sys.executable, "scripts/app.py"], check=True)
+def main(every=None):
+    update_data()
+
+    # Step 3: Launch Dashboard; it reloads data/processed by itself when a
+    # later build replaces the files
+    dashboard = subprocess.Popen([sys.executable, "scripts/app.py"])
+    try:
+        while every and dashboard.poll() is None:
+            time.sleep(every * 60)
+            try:
+                update_data()
+            except Exception as e:
+                print(f"Update failed, dashboard keeps the previous data ({e})")
+        dashboard.wait()
+    finally:
+        dashboard.terminate()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Update the data and serve the dashboard.")
+    parser.add_argument("--every", type=float, help="minutes between data updates while the dashboard runs (default: update once)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_args().every)
@@ -1,25 +1,52 @@
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import numpy as np
 import os
 import sys
+import argparse
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import time
 import re
 
+from trading_calendar import TradingCalendar
+from raw_store import RawStore, RetryQueue, FETCHED, NON_TRADING, FAILED, PARSE_ERROR
+from quotes import find_quote_table, quote_frame, write_quotes
+
 
 # =========================
 # Config
 # =========================
 BASE_DIR = "data"
+BASE_URL = "https://www.twse.com.tw/exchangeReport/MI_INDEX"
 SLEEP_SEC = 2
 
-try:
-    latest_folder = sorted(os.listdir(f"{BASE_DIR}/raw"))[-1]
-    START_DATE = datetime.strptime(latest_folder, "%Y%m%d") + timedelta(days=1)
-except:
-    START_DATE = datetime(2024, 1, 1)
-END_DATE = datetime.today()
+# TWSE blocks clients that go much faster than ~1 request / 2 seconds,
+# so the default rate keeps the old sequential pace.
+WORKERS = 1
+RATE_PER_SEC = 1 / SLEEP_SEC
+BURST = 1
+
+# every date since START_DATE without a fetched / non-trading entry in the
+# manifest is (re)requested, so a failed day is retried on the next run
+START_DATE = datetime(2024, 1, 1)
+# None: the day each run starts, so a long-running scheduler keeps moving forward
+END_DATE = None
+MANIFEST_FLUSH_EVERY = 20
+
+# retries inside one run; dates still failing go to the retry queue
+MAX_RETRIES = 4
+BACKOFF_BASE_SEC = 2
+BACKOFF_MAX_SEC = 60
+RETRY_STATUS = {429, 500, 502, 503, 504}
+TIMEOUT_SEC = 10
+
+# only the daily quote table is written by default (as typed Parquet);
+# the full response is still kept in the raw store
+ARCHIVE_TABLES = False
 
 
 # =========================
@@ -37,71 +64,349 @@ def clean_numeric_series(s):
         return s
 
 
-def fetch_mi_index(date_str: str):
-    url = (
-        "https://www.twse.com.tw/exchangeReport/MI_INDEX"
-        f"?response=json&date={date_str}&type=ALL"
-    )
-    r = requests.get(url, timeout=10)
+class RateLimiter:
+    """Token bucket shared by all fetch workers.
+
+    Tokens refill at `rate` per second up to `burst`; each request takes one.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchStats:
+    """Per-request latency and retry counts, shared by all workers."""
+
+    def __init__(self):
+        self.latencies = []
+        self.retries = 0
+        self.failures = 0
+        self.given_up = []
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def record_given_up(self, date_str):
+        with self.lock:
+            self.given_up.append(date_str)
+
+    def report(self):
+        if not self.latencies:
+            report = "Requests: 0"
+        else:
+            lat = np.array(self.latencies)
+            report = (
+                f"Requests: {len(lat)}, retries: {self.retries}, failed requests: {self.failures}, "
+                f"latency mean {lat.mean():.2f}s / p50 {np.percentile(lat, 50):.2f}s / "
+                f"p95 {np.percentile(lat, 95):.2f}s / max {lat.max():.2f}s"
+            )
+        if self.given_up:
+            report += f"\nDropped from the retry queue: {', '.join(sorted(self.given_up))}"
+        return report
+
+
+class RetryableError(Exception):
+    pass
+
+
+def make_session(pool_size=WORKERS):
+    """One keep-alive connection pool for the whole run, sized to the worker count."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def backoff_delay(attempt):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** attempt))
+
+
+def fetch_mi_index(date_str: str, base_url: str = BASE_URL, session=None):
+    url = f"{base_url}?response=json&date={date_str}&type=ALL"
+    r = (session or requests).get(url, timeout=TIMEOUT_SEC)
+
+    if r.status_code in RETRY_STATUS:
+        raise RetryableError(f"HTTP {r.status_code}")
     r.raise_for_status()
-    return r.json()
+
+    # when TWSE throttles a client it answers with an HTML page instead of JSON
+    try:
+        return r.json()
+    except ValueError:
+        raise RetryableError("non-JSON response (throttled?)")
+
+
+def fetch_with_retry(date_str, session, limiter, stats, base_url=BASE_URL, max_retries=MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        t0 = time.perf_counter()
+        try:
+            data = fetch_mi_index(date_str, base_url, session)
+            stats.record(time.perf_counter() - t0)
+            return data
+        except (RetryableError, requests.ConnectionError, requests.Timeout) as e:
+            stats.record(time.perf_counter() - t0)
+            if attempt == max_retries:
+                stats.record_failure()
+                raise
+            stats.record_retry()
+            delay = backoff_delay(attempt)
+            print(f"  {date_str}: {e}, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def date_range(start_date, end_date):
+    current_date = start_date
+    while current_date <= end_date:
+        yield current_date.strftime("%Y%m%d")
+        current_date += timedelta(days=1)
+
+
+def save_day(date_str, data, base_dir=BASE_DIR, archive_tables=ARCHIVE_TABLES):
+    """Write one MI_INDEX response; return False on a non-trading day.
+
+    The daily quote table goes to data/quotes/<date>.parquet with typed columns.
+    With archive_tables every table is also written to data/raw/<date>/ as CSV.
+    """
+    tables = data.get("tables", [])
+
+    # not a trading day
+    if not tables or all(t == {} for t in tables):
+        return False
+
+    # check date
+    table0_title = tables[0]["title"]
+    table0_title_date = table0_title.split(" ")[0]
+    date_match = re.search(r"(\d+)年(\d+)月(\d+)日", table0_title_date)
+    roc_year, month, day = map(int, date_match.groups())
+    data_date = f"{roc_year + 1911}{month:02d}{day:02d}"
+    if data_date != date_str:
+        raise ValueError(f"Date mismatch: {date_str} != {table0_title_date}")
+
+    quote_table = find_quote_table(tables)
+    if quote_table is None:
+        raise ValueError(f"Daily quote table not found for {date_str}")
+
+    quote_df = pd.DataFrame(quote_table["data"], columns=quote_table["fields"])
+    write_quotes(quote_frame(quote_df, date_str), date_str, base_dir)
+
+    if not archive_tables:
+        return True
+
+    # archive → one CSV per table
+    day_dir = os.path.join(base_dir, 'raw', date_str)
+    os.makedirs(day_dir, exist_ok=True)
+
+    for table in tables:
+        if not table:
+            continue
+
+        title = table["title"]
+        filename = os.path.join(day_dir, f"{title}.csv")
+
+        df = pd.DataFrame(table["data"], columns=table["fields"])
+        df.to_csv(filename, index=False)
+
+    return True
+
+
+def ingest(date_str, data, store, calendar, base_dir=BASE_DIR, archive_tables=ARCHIVE_TABLES, digest=None):
+    """Store a response, write its quotes and record the outcome in the manifest."""
+    digest = digest or store.put(data)
+
+    try:
+        saved = save_day(date_str, data, base_dir, archive_tables)
+    except Exception as e:
+        store.record(date_str, PARSE_ERROR, digest, e)
+        print(f"Parse error: {e}")
+        return
+
+    if saved:
+        store.record(date_str, FETCHED, digest)
+        calendar.mark_trading(date_str)
+        print(f"Saved {date_str}")
+    else:
+        store.record(date_str, NON_TRADING, digest)
+        calendar.mark_closed(date_str)
+        print("Not a trading day")
+
+
+def open_store(base_dir=BASE_DIR):
+    store = RawStore(os.path.join(base_dir, "store"))
+
+    # day folders written before the manifest existed count as fetched
+    raw_dir = os.path.join(base_dir, "raw")
+    if not store.manifest and os.path.isdir(raw_dir):
+        for name in os.listdir(raw_dir):
+            store.record(name, FETCHED)
+
+    return store
 
 
 # =========================
 # Main
 # =========================
-def main():
-    current_date = START_DATE
+def main(
+    start_date=None,
+    end_date=None,
+    workers=WORKERS,
+    rate=RATE_PER_SEC,
+    burst=BURST,
+    base_url=BASE_URL,
+    base_dir=BASE_DIR,
+    archive_tables=ARCHIVE_TABLES,
+    retry_given_up=False,
+):
+    start_date = start_date or START_DATE
+    end_date = end_date or END_DATE or datetime.today()
+    limiter = RateLimiter(rate, burst)
+    calendar = TradingCalendar(os.path.join(base_dir, "trading_calendar.json"))
+    store = open_store(base_dir)
+    retry_queue = RetryQueue(store.root)
+    if retry_given_up:
+        retry_queue.retry_given_up()
+    session = make_session(workers)
+    stats = FetchStats()
 
-    while current_date <= END_DATE:
-        date_str = current_date.strftime("%Y%m%d")
-        print(f"Processing {date_str} ...")
+    def fetch(date_str):
+        return fetch_with_retry(date_str, session, limiter, stats, base_url)
 
-        try:
-            data = fetch_mi_index(date_str)
-        except Exception as e:
-            print(f"Request failed: {e}")
-            current_date += timedelta(days=1)
-            continue
+    # finished days, weekends and known holidays never hit the network
+    dates = [
+        d for d in date_range(start_date, end_date)
+        if not store.is_done(d) and not calendar.is_closed(d) and d not in retry_queue
+    ]
 
-        tables = data.get("tables", [])        
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch, date_str): date_str for date_str in dates}
 
-        # not a trading day
-        if not tables or all(t == {} for t in tables):
-            print("Not a trading day")
-            current_date += timedelta(days=1)
-            time.sleep(SLEEP_SEC)
-            continue
+            # save each day as soon as its response arrives
+            for n, future in enumerate(as_completed(futures), 1):
+                date_str = futures[future]
+                print(f"Processing {date_str} ...")
 
-        # check date
-        table0_title = tables[0]["title"]
-        table0_title_date = table0_title.split(" ")[0]
-        date_match = re.search(r"(\d+)年(\d+)月(\d+)日", table0_title_date)
-        roc_year, month, day = map(int, date_match.groups())
-        data_date = f"{roc_year + 1911}{month:02d}{day:02d}"
-        if data_date != date_str:
-            sys.exit(f"Date mismatch: {date_str} != {table0_title_date}")
-        else:
-            pass
-        
-        # trading day → create folder
-        day_dir = os.path.join(BASE_DIR, 'raw', date_str)
-        os.makedirs(day_dir, exist_ok=True)
-
-        for table in tables:
-            if not table:
+                try:
+                    data = future.result()
+                except Exception as e:
+                    store.record(date_str, FAILED, error=e)
+                    if not retry_queue.push(date_str):
+                        stats.record_given_up(date_str)
+                    print(f"Request failed: {e}")
+                    continue
+
+                ingest(date_str, data, store, calendar, base_dir, archive_tables)
+
+                if n % MANIFEST_FLUSH_EVERY == 0:
+                    store.save()
+                    retry_queue.save()
+
+        # dead-letter queue: this run's failures plus those left over from earlier runs
+        for date_str in retry_queue.dates():
+            print(f"Retrying {date_str} (attempt {retry_queue.attempts[date_str] + 1}) ...")
+            try:
+                data = fetch(date_str)
+            except Exception as e:
+                store.record(date_str, FAILED, error=e)
+                if not retry_queue.push(date_str):
+                    stats.record_given_up(date_str)
+                print(f"Request failed: {e}")
                 continue
 
-            title = table["title"]
-            filename = os.path.join(day_dir, f"{title}.csv")
+            retry_queue.remove(date_str)
+            ingest(date_str, data, store, calendar, base_dir, archive_tables)
+    finally:
+        store.save()
+        retry_queue.save()
+        calendar.save()
+        session.close()
 
-            df = pd.DataFrame(table["data"], columns=table["fields"])
-            df.to_csv(filename, index=False)
+    print(stats.report())
+    if retry_queue:
+        print(f"Still failing, queued for next run: {', '.join(retry_queue.dates())}")
 
-        print(f"Saved {date_str}")
-        current_date += timedelta(days=1)
-        time.sleep(SLEEP_SEC)
+
+def reparse(start_date=None, end_date=None, base_dir=BASE_DIR, archive_tables=ARCHIVE_TABLES):
+    """Rebuild quote files (and archived tables) from stored responses without any network request."""
+    calendar = TradingCalendar(os.path.join(base_dir, "trading_calendar.json"))
+    store = open_store(base_dir)
+    start = (start_date or datetime.min).strftime("%Y%m%d")
+    end = (end_date or END_DATE or datetime.today()).strftime("%Y%m%d")
+
+    for date_str in store.dates():
+        if not start <= date_str <= end:
+            continue
+
+        data = store.get(date_str)
+        if data is None:
+            continue
+
+        print(f"Re-parsing {date_str} ...")
+        digest = store.manifest[date_str]["sha256"]
+        ingest(date_str, data, store, calendar, base_dir, archive_tables, digest)
+
+    store.save()
+    calendar.save()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download TWSE MI_INDEX daily reports.")
+    parser.add_argument("--start", type=lambda s: datetime.strptime(s, "%Y%m%d"), help="YYYYMMDD")
+    parser.add_argument("--end", type=lambda s: datetime.strptime(s, "%Y%m%d"), help="YYYYMMDD")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="concurrent requests")
+    parser.add_argument("--rate", type=float, default=RATE_PER_SEC, help="requests per second")
+    parser.add_argument("--burst", type=int, default=BURST, help="token bucket size")
+    parser.add_argument("--base-url", default=BASE_URL, help="MI_INDEX endpoint (e.g. a local stub)")
+    parser.add_argument("--base-dir", default=BASE_DIR)
+    parser.add_argument("--archive-tables", action="store_true", help="also write every table as CSV under data/raw")
+    parser.add_argument("--reparse", action="store_true", help="re-parse stored responses, no network")
+    parser.add_argument("--retry-given-up", action="store_true", help="queue the dates the retry queue gave up on again")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.reparse:
+        reparse(args.start, args.end, args.base_dir, args.archive_tables)
+        sys.exit()
+
+    main(
+        start_date=args.start,
+        end_date=args.end,
+        workers=args.workers,
+        rate=args.rate,
+        burst=args.burst,
+        base_url=args.base_url,
+        base_dir=args.base_dir,
+        archive_tables=args.archive_tables,
+        retry_given_up=args.retry_given_up,
+    )
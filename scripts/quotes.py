@@ -0,0 +1,90 @@
+import os
+import re
+
+import pandas as pd
+
+# =========================
+# Config
+# =========================
+QUOTES_DIR = "quotes"
+QUOTE_TABLE_TITLE = "每日收盤行情(全部)"
+
+# define patterns
+STOCK_PATTERN = re.compile(r"^\d{4}$")     # 2330
+ETF_PATTERN   = re.compile(r"^00\d{2,3}$") # 0050, 00878
+
+REQUIRED_COLS = [
+    "證券代號",
+    "證券名稱",
+    "開盤價",
+    "最高價",
+    "最低價",
+    "收盤價",
+    "成交股數",
+]
+
+QUOTE_COLUMNS = [
+    "date",
+    "stock_id",
+    "stock_name",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+]
+
+
+# =========================
+# Helpers
+# =========================
+def clean_numeric(s):
+    return pd.to_numeric(
+        s.astype(str)
+         .str.replace(",", "", regex=False)
+         .str.replace(r"<.*?>", "", regex=True)
+         .replace(["--", "", "nan"], pd.NA),
+        errors="coerce"
+    )
+
+def quote_frame(df: pd.DataFrame, date_str: str) -> pd.DataFrame:
+    """Turn the all-string 每日收盤行情 table into typed daily quotes for stocks and ETFs."""
+    missing = set(REQUIRED_COLS) - set(df.columns)
+    if missing:
+        raise ValueError(f"missing columns: {missing}")
+
+    # filter by stock or etf
+    codes = df["證券代號"].astype(str)
+    keep = codes.str.match(STOCK_PATTERN) | codes.str.match(ETF_PATTERN)
+    df = df[keep].copy()
+
+    # clean
+    df["open"]   = clean_numeric(df["開盤價"])
+    df["high"]   = clean_numeric(df["最高價"])
+    df["low"]    = clean_numeric(df["最低價"])
+    df["close"]  = clean_numeric(df["收盤價"])
+    df["volume"] = (clean_numeric(df["成交股數"]) / 1000).round(2)
+
+    # add date
+    df["date"] = pd.to_datetime(date_str)
+    df["stock_id"] = df["證券代號"]
+    df["stock_name"] = df["證券名稱"]
+
+    return df[QUOTE_COLUMNS].reset_index(drop=True)
+
+def find_quote_table(tables):
+    for table in tables:
+        if table and table.get("title", "").endswith(QUOTE_TABLE_TITLE):
+            return table
+    return None
+
+def quotes_path(date_str, base_dir="data"):
+    return os.path.join(base_dir, QUOTES_DIR, f"{date_str}.parquet")
+
+def write_quotes(df: pd.DataFrame, date_str: str, base_dir="data"):
+    path = quotes_path(date_str, base_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return path
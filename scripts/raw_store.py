@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+# =========================
+# Config
+# =========================
+STORE_DIR = Path("data/store")
+
+FETCHED = "fetched"
+NON_TRADING = "non_trading"
+FAILED = "failed"
+PARSE_ERROR = "parse_error"
+
+# dates in these states are never requested again
+DONE_STATUSES = {FETCHED, NON_TRADING}
+
+# a queued date is given up after this many failed attempts; a run can use
+# two (its first request and the end-of-run retry)
+MAX_ATTEMPTS = 5
+
+
+# =========================
+# Raw response store
+# =========================
+class RawStore:
+    """Content-addressed store of raw MI_INDEX responses plus a per-date manifest.
+
+    Responses are saved gzip-compressed under objects/<sha[:2]>/<sha>.json.gz,
+    keyed by the SHA-256 of the JSON body, so storing the same response twice
+    is a no-op. manifest.json maps each date to its status, object hash and
+    last error.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest = {}
+
+        if self.manifest_path.exists():
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    # ---------- objects ----------
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / f"{digest}.json.gz"
+
+    def put(self, data):
+        body = json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with gzip.open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+
+        return digest
+
+    def get(self, date_str):
+        digest = self.manifest.get(date_str, {}).get("sha256")
+        if not digest:
+            return None
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return json.loads(f.read())
+
+    # ---------- manifest ----------
+    def status(self, date_str):
+        return self.manifest.get(date_str, {}).get("status")
+
+    def is_done(self, date_str):
+        return self.status(date_str) in DONE_STATUSES
+
+    def record(self, date_str, status, digest=None, error=None):
+        entry = self.manifest.setdefault(date_str, {})
+        entry["status"] = status
+        entry["updated"] = datetime.now().isoformat(timespec="seconds")
+        if digest:
+            entry["sha256"] = digest
+        if error:
+            entry["error"] = str(error)
+        else:
+            entry.pop("error", None)
+
+    def dates(self, status=None):
+        return sorted(d for d, e in self.manifest.items() if status is None or e["status"] == status)
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+
+# =========================
+# Dead-letter queue
+# =========================
+class RetryQueue:
+    """Dates whose fetch still failed after all retries, with their attempt counts.
+
+    Persisted next to the manifest so a crash or a TWSE outage never loses them.
+    A date that fails max_attempts times moves to `given_up` and is no longer
+    requested until it is retried by hand (retry_given_up).
+    """
+
+    def __init__(self, root=STORE_DIR, max_attempts=MAX_ATTEMPTS):
+        self.path = Path(root) / "retry_queue.json"
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self.given_up = {}
+
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            # older queues were a bare {date: attempts} map
+            if "attempts" in data:
+                self.attempts, self.given_up = data["attempts"], data.get("given_up", {})
+            else:
+                self.attempts = data
+
+    def __len__(self):
+        return len(self.attempts)
+
+    def __contains__(self, date_str):
+        return date_str in self.attempts or date_str in self.given_up
+
+    def dates(self):
+        return sorted(self.attempts)
+
+    def push(self, date_str):
+        """Count a failed attempt; False once the date is given up."""
+        attempts = self.attempts.pop(date_str, 0) + 1
+        if attempts >= self.max_attempts:
+            self.given_up[date_str] = attempts
+            return False
+        self.attempts[date_str] = attempts
+        return True
+
+    def remove(self, date_str):
+        self.attempts.pop(date_str, None)
+        self.given_up.pop(date_str, None)
+
+    def retry_given_up(self):
+        """Queue the given-up dates again with a fresh attempt count."""
+        for date_str in self.given_up:
+            self.attempts[date_str] = 0
+        self.given_up = {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"attempts": self.attempts, "given_up": self.given_up}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
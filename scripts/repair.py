@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import build_table
+import query_data
+from daily_table import read_daily
+from indicator_state import IndicatorState
+from quotes import QUOTE_COLUMNS, quotes_path
+from trading_calendar import TradingCalendar
+
+# =========================
+# Config
+# =========================
+BASE_DIR = query_data.BASE_DIR
+
+# a day with fewer rows than this fraction of the median day is treated as truncated
+TRUNCATED_RATIO = 0.8
+
+# stock / ETF row counts of legacy CSV folders, keyed by the CSV's mtime
+ROW_COUNT_CACHE = os.path.join(BASE_DIR, "store", "row_counts.json")
+
+
+# =========================
+# Gap detection
+# =========================
+def row_count(date_str, source):
+    """Stock / ETF rows of a day (what quote_frame keeps), from Parquet metadata or the CSV; None if unreadable."""
+    try:
+        if source.suffix == ".parquet":
+            return pq.read_metadata(source).num_rows
+
+        df = build_table.load_day(date_str, source)
+        return None if df is None else len(df)
+    except Exception:
+        return None
+
+
+def row_counts(sources, cache_path=ROW_COUNT_CACHE):
+    """row_count of every day; CSV folders are parsed once and their counts cached until the CSV changes."""
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+
+    counts, changed = {}, False
+    for date_str, source in sources.items():
+        if source.suffix == ".parquet":
+            counts[date_str] = row_count(date_str, source)
+            continue
+
+        csv_path = next(source.glob("*每日收盤行情(全部).csv"), None)
+        mtime = csv_path.stat().st_mtime_ns if csv_path is not None else None
+        cached = cache.get(date_str)
+        if cached is not None and cached["mtime"] == mtime:
+            counts[date_str] = cached["rows"]
+            continue
+
+        counts[date_str] = row_count(date_str, source)
+        if mtime is not None and counts[date_str] is not None:
+            cache[date_str] = {"mtime": mtime, "rows": counts[date_str]}
+            changed = True
+
+    if changed:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=0, sort_keys=True)
+        os.replace(tmp, cache_path)
+    return counts
+
+
+def expected_days(calendar, sources):
+    """Known trading days plus weekdays the calendar knows nothing about, between the first and last day on disk."""
+    days = set(calendar.trading)
+    if not sources:
+        return sorted(days)
+
+    first = datetime.strptime(min(sources), "%Y%m%d")
+    last = datetime.strptime(max(sources), "%Y%m%d")
+    current = first
+    while current <= last:
+        date_str = current.strftime("%Y%m%d")
+        if date_str not in calendar.closed and not calendar.is_weekend(date_str):
+            days.add(date_str)
+        current += timedelta(days=1)
+
+    return sorted(days)
+
+
+def find_gaps(calendar, sources):
+    counts = row_counts(sources)
+    valid = [c for c in counts.values() if c]
+    threshold = np.median(valid) * TRUNCATED_RATIO if valid else 0
+
+    missing = [d for d in expected_days(calendar, sources) if d not in sources]
+    truncated = [d for d, c in counts.items() if c is None or c < threshold]
+    return missing, truncated, threshold
+
+
+# =========================
+# Refetch
+# =========================
+def refetch(dates, min_rows=0, base_dir=BASE_DIR, base_url=query_data.BASE_URL):
+    """Re-parse stored responses where possible, hit the network only for the rest.
+
+    Days the store or the calendar already records as closed are skipped.
+    """
+    calendar = TradingCalendar(os.path.join(base_dir, "trading_calendar.json"))
+    store = query_data.open_store(base_dir)
+    limiter = query_data.RateLimiter(query_data.RATE_PER_SEC, query_data.BURST)
+    session = query_data.make_session()
+    stats = query_data.FetchStats()
+    repaired = []
+
+    try:
+        for date_str in dates:
+            if store.status(date_str) == query_data.NON_TRADING or calendar.is_closed(date_str):
+                print(f"Skipping {date_str}: not a trading day")
+                continue
+
+            print(f"Repairing {date_str} ...")
+            stored = store.get(date_str)
+            source = None
+
+            if stored is not None:
+                digest = store.manifest[date_str]["sha256"]
+                query_data.ingest(date_str, stored, store, calendar, base_dir, digest=digest)
+                path = Path(quotes_path(date_str, base_dir))
+                source = path if path.exists() else None
+
+            rows = row_count(date_str, source) if source is not None else None
+            if rows is None or rows < min_rows:
+                try:
+                    data = query_data.fetch_with_retry(date_str, session, limiter, stats, base_url)
+                except Exception as e:
+                    store.record(date_str, query_data.FAILED, error=e)
+                    print(f"Request failed: {e}")
+                    continue
+                query_data.ingest(date_str, data, store, calendar, base_dir)
+
+            if store.status(date_str) == query_data.FETCHED:
+                repaired.append(date_str)
+    finally:
+        store.save()
+        calendar.save()
+        session.close()
+
+    print(stats.report())
+    return repaired
+
+
+# =========================
+# Targeted rebuild
+# =========================
+def rebuild(dates):
+    """Recompute indicators only for stocks that have rows on the repaired dates.
+
+    The other stocks' rows in daily.parquet are kept as they are, and the
+    affected stocks are rebuilt from the quotes already in daily.parquet plus
+    the repaired days, so no other day is read from disk.
+    """
+    if not build_table.OUT_FILE_DAILY_PARQUET.exists():
+        build_table.main()
+        return
+
+    sources = build_table.day_sources()
+    frames = {d: build_table.load_day(d, sources[d]) for d in dates if d in sources}
+    frames = {d: df for d, df in frames.items() if df is not None}
+    if not frames:
+        return
+
+    new_df = pd.concat(frames.values(), ignore_index=True)
+    repaired_dates = pd.to_datetime(dates, format="%Y%m%d")
+
+    daily = read_daily(build_table.OUT_FILE_DAILY_PARQUET)
+    on_repaired = daily["date"].isin(repaired_dates)
+    affected = set(new_df["stock_id"]) | set(daily.loc[on_repaired, "stock_id"])
+    is_affected = daily["stock_id"].isin(affected)
+
+    print(f"Rebuilding {len(affected)} stocks for {len(dates)} repaired days")
+    base_df = pd.concat(
+        [daily.loc[is_affected & ~on_repaired, QUOTE_COLUMNS], new_df],
+        ignore_index=True,
+    )
+    seeds = {}
+    rebuilt = build_table.add_indicators(base_df, seeds)
+
+    final_df = (
+        pd.concat([daily[~is_affected], rebuilt[daily.columns]], ignore_index=True)
+        .sort_values(["stock_id", "date"], kind="stable")
+        .reset_index(drop=True)
+    )
+
+    # keep the incremental-build state in step; without one the next build is a full one anyway
+    build_state = build_table.load_build_state()
+    if not build_table.OUT_FILE_STATE.exists() or build_state is None:
+        build_table.save_outputs(final_df)
+    else:
+        all_seeds = IndicatorState.load(build_table.OUT_FILE_STATE).ewm_seeds()
+        all_seeds.update(seeds)
+        skipped = {d: mtime for d, mtime in build_state["skipped"].items() if d not in frames}
+        build_table.save_outputs(
+            final_df, IndicatorState.from_build(final_df, all_seeds), {*build_state["days"], *frames}, skipped
+        )
+
+
+# =========================
+# Main
+# =========================
+def main(dry_run=False, rebuild_tables=True, base_url=query_data.BASE_URL):
+    calendar = TradingCalendar()
+    missing, truncated, min_rows = find_gaps(calendar, build_table.day_sources())
+
+    print(f"Missing days:   {', '.join(missing) or '-'}")
+    print(f"Truncated days: {', '.join(truncated) or '-'}")
+
+    dates = sorted(set(missing) | set(truncated))
+    if dry_run or not dates:
+        return
+
+    repaired = refetch(dates, min_rows, base_url=base_url)
+    print(f"Repaired {len(repaired)} / {len(dates)} days")
+
+    if rebuild_tables and repaired:
+        rebuild(repaired)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find and refetch missing or truncated trading days.")
+    parser.add_argument("--dry-run", action="store_true", help="only report gaps")
+    parser.add_argument("--no-rebuild", action="store_true", help="skip the targeted daily.parquet rebuild")
+    parser.add_argument("--base-url", default=query_data.BASE_URL, help="MI_INDEX endpoint (e.g. a local stub)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(dry_run=args.dry_run, rebuild_tables=not args.no_rebuild, base_url=args.base_url)
@@ -0,0 +1,171 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from strategy import SIGNAL_BITS, RuleSet, signal_labels, signal_name
+
+# =========================
+# Config
+# =========================
+DAILY_FILE = Path("data/processed/daily.parquet")
+INDEX_COLUMNS = ["date", "stock_id", "stock_name", "signal_code"]
+SHOW_COLUMNS = ["close", "close_change_pct", "volume_ratio_5d"]
+
+
+# =========================
+# Index
+# =========================
+class Screener:
+    """Cross-sectional queries over daily.parquet without full-frame scans.
+
+    The table is kept ordered by (date, stock_id), so every trading day, and
+    every run of days, is one contiguous row range found by binary search on
+    the date offsets. Signals are tested on the signal_code bitmask of that
+    range only; other columns are read from the Parquet file (one column at
+    a time, on first use) into the same order.
+    """
+
+    def __init__(self, daily_file=DAILY_FILE):
+        self.daily_file = Path(daily_file)
+        df = pq.read_table(self.daily_file, columns=INDEX_COLUMNS).to_pandas()
+
+        # integer stock codes in stock_id order: cheaper to sort and search than strings
+        self.stock_ids, stocks = np.unique(df["stock_id"].to_numpy(), return_inverse=True)
+        self.order = np.lexsort((stocks, df["date"].to_numpy()))
+        self.cache = {col: df[col].to_numpy()[self.order] for col in INDEX_COLUMNS}
+        self.stocks = stocks[self.order].astype(np.int32)
+
+        self.dates, starts = np.unique(self.cache["date"], return_index=True)
+        self.offsets = np.r_[starts, len(self.order)]
+
+    def column(self, name):
+        if name not in self.cache:
+            values = pq.read_table(self.daily_file, columns=[name]).column(0).to_numpy()
+            self.cache[name] = values[self.order]
+        return self.cache[name]
+
+    def date_position(self, date):
+        """Index into self.dates of the last trading day on or before `date`."""
+        i = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date), "ns"), side="right") - 1
+        if i < 0:
+            raise ValueError(f"no data on or before {date}")
+        return int(i)
+
+    def rows(self, first, last):
+        """Row range of trading days first..last (positions in self.dates)."""
+        return slice(self.offsets[first], self.offsets[last + 1])
+
+    # ---------- queries ----------
+    def signal_hits(self, signals, first, last):
+        """Stocks with any of `signals` in days first..last: stock ids, last hit date, OR of their codes."""
+        rows = self.rows(first, last)
+        codes = self.cache["signal_code"][rows]
+
+        mask_bits = 0
+        for name in signals:
+            mask_bits |= 1 << SIGNAL_BITS.index(signal_name(name))
+        hit = (codes & codes.dtype.type(mask_bits)) != 0
+
+        stocks = self.stocks[rows][hit]
+        dates = self.cache["date"][rows][hit]
+        codes = codes[hit]
+
+        by_stock = np.argsort(stocks, kind="stable")
+        stocks, starts = np.unique(stocks[by_stock], return_index=True)
+        index = pd.Index(self.stock_ids[stocks], name="stock_id")
+        if len(stocks) == 0:
+            return pd.DataFrame({"last_signal_date": dates[:0], "code": codes[:0]}, index=index)
+        return pd.DataFrame({
+            "last_signal_date": np.maximum.reduceat(dates[by_stock], starts),
+            "code": np.bitwise_or.reduceat(codes[by_stock], starts),
+        }, index=index)
+
+    def evaluate(self, where, day):
+        """Boolean mask over the rows of trading day `day` for a rule-style expression."""
+        rules = RuleSet({"signals": {"where": where}})
+        rows = self.rows(day, day)
+        c = {col: self.column(col)[rows] for col in rules.columns}
+
+        if rules.prev_columns:
+            prev_rows = self.rows(day - 1, day - 1) if day > 0 else slice(0, 0)
+            prev_ids = self.stocks[prev_rows]
+            ids = self.stocks[rows]
+            k = np.searchsorted(prev_ids, ids)
+            found = k < len(prev_ids)
+            found[found] = prev_ids[k[found]] == ids[found]
+            for col in rules.prev_columns:
+                prev = np.full(len(ids), np.nan)
+                prev[found] = self.column(col)[prev_rows][k[found]]
+                c[f"prev_{col}"] = prev
+
+        return rules.evaluate(c, counter=None)["where"], sorted(rules.columns)
+
+    def screen(self, signals=(), days=1, where=None, as_of=None, all_history=False):
+        """Stocks trading on `as_of` (default: the last day) that match the query.
+
+        signals  signal names or signal_today words; a stock matches if any of
+                 them fired within the last `days` trading days (or ever, with
+                 all_history)
+        where    rule-style expression on the as_of row, e.g.
+                 "volume_ratio_5d > 2 and close > MA20"
+        """
+        last = self.date_position(as_of) if as_of is not None else len(self.dates) - 1
+        first = 0 if all_history else max(0, last - days + 1)
+
+        rows = self.rows(last, last)
+        keep = np.ones(rows.stop - rows.start, dtype=bool)
+        shown = list(SHOW_COLUMNS)
+
+        if where:
+            mask, where_columns = self.evaluate(where, last)
+            keep &= mask
+            shown += [col for col in where_columns if col not in shown]
+
+        result = pd.DataFrame({
+            "stock_id": self.cache["stock_id"][rows][keep],
+            "stock_name": self.cache["stock_name"][rows][keep],
+            "date": self.cache["date"][rows][keep],
+        })
+        for col in shown:
+            result[col] = self.column(col)[rows][keep]
+
+        if signals:
+            hits = self.signal_hits(signals, first, last)
+            result = result.join(hits, on="stock_id", how="inner")
+            result["signals"] = signal_labels(result.pop("code").to_numpy())
+
+        return result.reset_index(drop=True)
+
+
+# =========================
+# Main
+# =========================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Screen stocks by recent signals and conditions on the latest day.")
+    parser.add_argument("--signal", action="append", default=[], help="signal name or signal_today word; repeat for any-of")
+    parser.add_argument("--days", type=int, default=1, help="trading days the signal may have fired in")
+    parser.add_argument("--all", action="store_true", help="signal fired anywhere in history")
+    parser.add_argument("--where", help='condition on the as-of day, e.g. "volume_ratio_5d > 2"')
+    parser.add_argument("--as-of", help="YYYY-MM-DD (default: last trading day)")
+    parser.add_argument("--daily", default=DAILY_FILE)
+    parser.add_argument("--limit", type=int, default=50)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    t0 = time.perf_counter()
+    screener = Screener(args.daily)
+    print(f"Index: {len(screener.order)} rows, {len(screener.dates)} days, {time.perf_counter() - t0:.2f} s")
+
+    t0 = time.perf_counter()
+    result = screener.screen(args.signal, args.days, args.where, args.as_of, args.all)
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    print(result.head(args.limit).to_string(index=False))
+    print(f"{len(result)} stocks, {elapsed:.1f} ms")
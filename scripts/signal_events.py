@@ -0,0 +1,184 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from strategy import SIGNAL_BITS, has_signal, signal_name
+
+# =========================
+# Config
+# =========================
+EVENTS_FILE = Path("data/processed/signal_events.npz")
+DAILY_FILE = Path("data/processed/daily.parquet")
+
+
+# =========================
+# Signal events
+# =========================
+class SignalEvents:
+    """Every row on which a signal fired, indexed for binary search.
+
+    Stocks are integer codes into the sorted `stock_id` array. For each
+    signal there are two orderings of the same events:
+
+      <signal>_date, <signal>_stock    by (date, stock): who fired in a date range
+      <signal>_stock_date              by (stock, date), stock i's events at
+                                       <signal>_offsets[i]:<signal>_offsets[i + 1]
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    # ---------- construction ----------
+    @classmethod
+    def from_daily(cls, daily: pd.DataFrame):
+        """Index the signal_code column of a daily frame (any row order)."""
+        stock_ids, stocks = np.unique(daily["stock_id"].to_numpy().astype("U8"), return_inverse=True)
+        dates = daily["date"].to_numpy(dtype="datetime64[ns]")
+        codes = daily["signal_code"].to_numpy()
+
+        by_date = np.lexsort((stocks, dates))
+        by_stock = np.lexsort((dates, stocks))
+        arrays = {"stock_id": stock_ids, "signals": np.array(SIGNAL_BITS)}
+        for name in SIGNAL_BITS:
+            hit = has_signal(codes, name)
+
+            rows = by_date[hit[by_date]]
+            arrays[f"{name}_date"] = dates[rows]
+            arrays[f"{name}_stock"] = stocks[rows].astype(np.int32)
+
+            rows = by_stock[hit[by_stock]]
+            arrays[f"{name}_stock_date"] = dates[rows]
+            arrays[f"{name}_offsets"] = np.r_[0, np.cumsum(np.bincount(stocks[rows], minlength=len(stock_ids)))]
+        return cls(arrays)
+
+    def extend(self, new_rows: pd.DataFrame):
+        """Index with the signal rows of `new_rows` added, re-sorting only the events, not the daily rows."""
+        old_ids = self.arrays["stock_id"]
+        stock_ids = np.union1d(old_ids, new_rows["stock_id"].to_numpy().astype("U8"))
+        old_stocks = np.searchsorted(stock_ids, old_ids)
+        new_stocks = np.searchsorted(stock_ids, new_rows["stock_id"].to_numpy().astype("U8"))
+        new_dates = new_rows["date"].to_numpy(dtype="datetime64[ns]")
+        codes = new_rows["signal_code"].to_numpy()
+
+        arrays = {"stock_id": stock_ids, "signals": np.array(SIGNAL_BITS)}
+        for name in SIGNAL_BITS:
+            hit = has_signal(codes, name)
+            counts = np.diff(self.arrays[f"{name}_offsets"])
+            stocks = np.r_[np.repeat(old_stocks, counts), new_stocks[hit]]
+            dates = np.r_[self.arrays[f"{name}_stock_date"], new_dates[hit]]
+
+            rows = np.lexsort((stocks, dates))
+            arrays[f"{name}_date"] = dates[rows]
+            arrays[f"{name}_stock"] = stocks[rows].astype(np.int32)
+
+            rows = np.lexsort((dates, stocks))
+            arrays[f"{name}_stock_date"] = dates[rows]
+            arrays[f"{name}_offsets"] = np.r_[0, np.cumsum(np.bincount(stocks, minlength=len(stock_ids)))]
+        return SignalEvents(arrays)
+
+    @classmethod
+    def load(cls, path=EVENTS_FILE):
+        with np.load(path, allow_pickle=False) as f:
+            arrays = {key: f[key] for key in f.files}
+        if list(arrays["signals"]) != SIGNAL_BITS:
+            raise ValueError(f"{path} was built for other strategy rules")
+        return cls(arrays)
+
+    def save(self, path=EVENTS_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, **self.arrays)
+
+    # ---------- lookups ----------
+    def stock_index(self, stock_id):
+        stock_ids = self.arrays["stock_id"]
+        i = np.searchsorted(stock_ids, stock_id)
+        return int(i) if i < len(stock_ids) and stock_ids[i] == stock_id else None
+
+    def between(self, signal, start=None, end=None):
+        """Events of `signal` (name or signal_today word) from start to end inclusive, by date and stock_id."""
+        name = signal_name(signal)
+        dates = self.arrays[f"{name}_date"]
+        lo, hi = date_bounds(dates, start, end)
+        return pd.DataFrame({
+            "date": dates[lo:hi],
+            "stock_id": self.arrays["stock_id"][self.arrays[f"{name}_stock"][lo:hi]],
+        })
+
+    def stock_dates(self, signal, stock_id, start=None, end=None):
+        """Dates on which one stock fired `signal`, oldest first."""
+        name = signal_name(signal)
+        i = self.stock_index(stock_id)
+        if i is None:
+            return np.array([], dtype="datetime64[ns]")
+        offsets = self.arrays[f"{name}_offsets"]
+        dates = self.arrays[f"{name}_stock_date"][offsets[i]:offsets[i + 1]]
+        lo, hi = date_bounds(dates, start, end)
+        return dates[lo:hi]
+
+    def last(self, signal, stock_id, on_or_before=None):
+        """Latest date a stock fired `signal`, or None."""
+        dates = self.stock_dates(signal, stock_id, end=on_or_before)
+        return pd.Timestamp(dates[-1]) if len(dates) else None
+
+
+def date_bounds(dates, start=None, end=None):
+    """Slice bounds of the sorted `dates` that fall in [start, end]."""
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+    hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end), "ns"), side="right")
+    return lo, hi
+
+def load_events(daily_file=None, path=EVENTS_FILE):
+    """The saved index, or one built from `daily_file` when the file is missing or from other rules."""
+    try:
+        return SignalEvents.load(path)
+    except (FileNotFoundError, ValueError) as e:
+        if daily_file is None:
+            raise
+        print(f"Indexing signal events in memory ({e})")
+        return SignalEvents.from_daily(pd.read_parquet(daily_file, columns=["stock_id", "date", "signal_code"]))
+
+
+# =========================
+# Main
+# =========================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Look up when signals fired.")
+    parser.add_argument("signal", help="signal name or signal_today word")
+    parser.add_argument("--stock", help="one stock's events (default: all stocks)")
+    parser.add_argument("--start", help="YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY-MM-DD")
+    parser.add_argument("--last", action="store_true", help="only the latest event of --stock")
+    parser.add_argument("--events", default=EVENTS_FILE)
+    parser.add_argument("--daily", help="index this daily.parquet instead of reading --events")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.daily:
+        events = SignalEvents.from_daily(pd.read_parquet(args.daily, columns=["stock_id", "date", "signal_code"]))
+    else:
+        events = SignalEvents.load(args.events)
+
+    t0 = time.perf_counter()
+    if args.stock and args.last:
+        result = events.last(args.signal, args.stock, args.end)
+    elif args.stock:
+        result = pd.DatetimeIndex(events.stock_dates(args.signal, args.stock, args.start, args.end))
+    else:
+        result = events.between(args.signal, args.start, args.end)
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    if isinstance(result, pd.DataFrame):
+        print(result.to_string(index=False))
+        print(f"{len(result)} events, {elapsed:.2f} ms")
+    elif isinstance(result, pd.DatetimeIndex):
+        print("\n".join(result.strftime("%Y-%m-%d")))
+        print(f"{len(result)} events, {elapsed:.2f} ms")
+    else:
+        print(result.strftime("%Y-%m-%d") if result is not None else "never")
+        print(f"{elapsed:.2f} ms")
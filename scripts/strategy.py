@@ -1,114 +1,372 @@
+import argparse
+import ast
+import hashlib
+import json
+import operator
+import time
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 
+from daily_table import read_daily
+from indicators import segment_positions, group_shift
+
 # =========================
-# Signal Labeling
+# Config
 # =========================
-def get_signal_label(r):
-    sig_list = []
-    if r["entry_pullback"]: sig_list.append("pullback")
-    if r["entry_breakout"]: sig_list.append("breakout")
-    if r["entry_continuation"]: sig_list.append("continuation")
-    if r["exit_trend"]: sig_list.append("exit")
-    if r["exit_emergency"]: sig_list.append("emergency")
-    
-    return "+".join(sig_list) if sig_list else "none"
+RULES_FILE = Path(__file__).with_name("strategy_rules.json")
+DAILY_FILE = Path("data/processed/daily.parquet")
 
 
-def calculate_signals(df: pd.DataFrame) -> pd.DataFrame:
+# =========================
+# Rule compiler
+# =========================
+# A rules file declares
+#   params:   named numbers (thresholds) usable in any expression; a RuleSet
+#             can override them, e.g. for a parameter sweep
+#   terms:    named sub-expressions, inlined wherever they are used
+#   signals:  boolean columns, evaluated in file order; a signal may use the
+#             signals and counters declared before it
+#   counters: {"since": signal, "never": value}, bars since that signal last
+#             fired in the stock (before the first one: `never`, or the row
+#             number when no `never` is given); computed right after its signal
+#   labels:   signal → word in signal_today
+# Expressions are Python syntax over column names, prev_<column> for
+# yesterday's value, numbers, + - * /, comparisons and and / or / not.
+# Every sub-expression is interned once, so a term shared by several rules
+# is evaluated once per call.
 
-    df = df.sort_values("date").copy()
+# ast operator class name → function
+ARITHMETIC = {
+    "Add": operator.add,
+    "Sub": operator.sub,
+    "Mult": operator.mul,
+    "Div": operator.truediv,
+}
+COMPARISONS = {
+    "Gt": operator.gt,
+    "GtE": operator.ge,
+    "Lt": operator.lt,
+    "LtE": operator.le,
+    "Eq": operator.eq,
+    "NotEq": operator.ne,
+}
+OPERATORS = {**ARITHMETIC, **COMPARISONS}
 
-    # =========================
-    # KD cross & bars since cross
-    # =========================
-    df["kd_cross"] = (
-        (df["K"] > df["D"]) &
-        (df["K"].shift(1) <= df["D"].shift(1))
-    )
 
-    df["bars_after_kd_cross"] = df["kd_cross"].cumsum()
-    df["bars_after_kd_cross"] = df.groupby("bars_after_kd_cross").cumcount()
+class RuleSet:
+    def __init__(self, spec, params=None):
+        self.params = dict(spec.get("params", {}))
+        unknown = set(params or {}) - set(self.params)
+        if unknown:
+            raise ValueError(f"unknown rule params: {sorted(unknown)}")
+        self.params.update(params or {})
 
-    # if never crossed
-    df.loc[df["kd_cross"].cumsum() == 0, "bars_after_kd_cross"] = 999
+        self.spec = {**spec, "params": self.params}
+        self.digest = hashlib.sha256(json.dumps(self.spec, sort_keys=True).encode("utf-8")).hexdigest()
 
-    kd_gap = df["K"] - df["D"]
+        self.nodes = []      # node id → (op, args)
+        self.node_ids = {}   # (op, args) → node id
+        self.references = 0  # sub-expressions before deduplication
+        self.columns = set()
+        self.prev_columns = set()
 
-    # =========================
-    # Entry strategies
-    # =========================
-    df["entry_pre_pullback"] = (
-        (df["DIF"] > 0) &
-        (df["MACD"] > 0) &
-        (df["DIF"] > df["MACD"]) &
-        (df["K"] < df["D"]) &
-        ((df["D"] - df["K"]) < 3) &
-        (df["close"] > df["MA10"])
-    )
-
-    df["entry_pullback"] = (
-        (df["DIF"] > 0) &
-        (df["MACD"] > 0) &
-        (df["DIF"] > df["MACD"]) &
-        (df["bars_after_kd_cross"] <= 2) &
-        (kd_gap > kd_gap.shift(1)) &
-        (df["K"] < 80) &
-        (df["close"] > df["MA10"])
-    )
-
-    df["entry_breakout"] = (
-        (df["DIF"] > 0) &
-        (df["MACD"] > 0) &
-        (df["DIF"] > df["MACD"]) &
-        (df["K"] > 50) &
-        (df["close"] > df["MA10"]) &
-        (df["close"].shift(1) <= df["MA10"])
-    )
-
-    df["entry_continuation"] = (
-        (df["DIF"] > 0) &
-        (df["MACD"] > 0) &
-        (df["DIF"] > df["MACD"]) &
-        (df["K"] > 50) &
-        (df["K"] < 80) &
-        (df["close"] > df["MA10"])
-    )
-
-    df["any_entry"] = (
-        df["entry_pullback"] |
-        df["entry_breakout"] |
-        df["entry_continuation"]
-    )
-
-    entry_groups = df["any_entry"].cumsum()
-    df["bars_since_entry"] = df.groupby(entry_groups).cumcount()
+        self.terms = dict(spec.get("terms", {}))
+        self.term_nodes = {}
+        self.defined = set()
 
-    # =========================
-    # Exit strategies
-    # =========================
-    df["exit_emergency"] = df["close"] < (df["MA20"] * 0.97)
+        self.signals = []
+        self.counters = {}
+        self.outputs = []    # (name, node id or None for counters), in column order
+
+        by_source = {}
+        for name, counter in spec.get("counters", {}).items():
+            by_source.setdefault(counter["since"], []).append((name, counter.get("never")))
+
+        for name, expr in spec["signals"].items():
+            self.outputs.append((name, self.compile(expr)))
+            self.signals.append(name)
+            self.defined.add(name)
+
+            for counter, never in by_source.pop(name, []):
+                self.outputs.append((counter, None))
+                self.counters[counter] = (name, never)
+                self.defined.add(counter)
+
+        if by_source:
+            raise ValueError(f"counters on unknown signals: {sorted(by_source)}")
+
+        self.labels = list(spec.get("labels", {}).items())
+        unknown = [col for col, _ in self.labels if col not in self.signals]
+        if unknown:
+            raise ValueError(f"labels for unknown signals: {unknown}")
+
+    @classmethod
+    def load(cls, path=RULES_FILE, params=None):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), params)
+
+    @property
+    def output_names(self):
+        return [name for name, _ in self.outputs]
+
+    # ---------- compile ----------
+    def compile(self, expr):
+        try:
+            tree = ast.parse(expr, mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"bad rule expression {expr!r}: {e}") from None
+        return self.node(tree)
+
+    def intern(self, op, *args):
+        self.references += 1
+        key = (op, args)
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.node_ids[key]
+
+    def logical(self, op, children):
+        ids = set()
+        for child in children:
+            child_op, child_args = self.nodes[child]
+            ids.update(child_args if child_op == op else [child])
+        return self.intern(op, *sorted(ids))
+
+    def node(self, tree):
+        if isinstance(tree, ast.BoolOp):
+            op = "and" if isinstance(tree.op, ast.And) else "or"
+            return self.logical(op, [self.node(v) for v in tree.values])
+
+        if isinstance(tree, ast.BinOp) and isinstance(tree.op, (ast.BitAnd, ast.BitOr)):
+            op = "and" if isinstance(tree.op, ast.BitAnd) else "or"
+            return self.logical(op, [self.node(tree.left), self.node(tree.right)])
+
+        if isinstance(tree, ast.BinOp) and type(tree.op).__name__ in ARITHMETIC:
+            return self.intern(type(tree.op).__name__, self.node(tree.left), self.node(tree.right))
+
+        if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, (ast.Not, ast.Invert)):
+            return self.intern("not", self.node(tree.operand))
+
+        if isinstance(tree, ast.UnaryOp) and isinstance(tree.op, ast.USub):
+            return self.intern("neg", self.node(tree.operand))
+
+        if isinstance(tree, ast.Compare) and all(type(op).__name__ in COMPARISONS for op in tree.ops):
+            operands = [self.node(tree.left)] + [self.node(v) for v in tree.comparators]
+            pairs = [
+                self.intern(type(op).__name__, left, right)
+                for op, left, right in zip(tree.ops, operands, operands[1:])
+            ]
+            return pairs[0] if len(pairs) == 1 else self.logical("and", pairs)
+
+        if isinstance(tree, ast.Constant) and isinstance(tree.value, (int, float)) and not isinstance(tree.value, bool):
+            return self.intern("const", tree.value)
+
+        if isinstance(tree, ast.Name):
+            return self.name(tree.id)
+
+        raise ValueError(f"unsupported rule expression: {ast.unparse(tree)}")
+
+    def name(self, name):
+        if name in self.params:
+            return self.intern("const", self.params[name])
+
+        if name in self.terms:
+            if name not in self.term_nodes:
+                self.term_nodes[name] = None  # guards against self-reference
+                self.term_nodes[name] = self.compile(self.terms[name])
+            elif self.term_nodes[name] is None:
+                raise ValueError(f"term {name!r} refers to itself")
+            return self.term_nodes[name]
+
+        if name in self.defined:
+            return self.intern("ref", name)
+
+        if name.startswith("prev_"):
+            self.prev_columns.add(name[len("prev_"):])
+        else:
+            self.columns.add(name)
+        return self.intern("col", name)
+
+    # ---------- evaluate ----------
+    def evaluate(self, c, counter, timings=None):
+        """Evaluate every signal and counter.
 
-    exit_allowed = df["bars_since_entry"] > 3
+        `c` maps column and prev_<column> names to arrays; counter(name,
+        flags, never) returns a counter's values from its signal. Returns
+        {name: array} in column order; `timings` (if given) gets the seconds
+        spent on each output, shared sub-expressions counting once.
+        """
+        values = {}
+        results = {}
 
-    kd_death_cross = (
-        (df["K"] < df["D"]) &
-        (df["K"].shift(1) >= df["D"].shift(1))
-    )
+        def value(i):
+            if i in values:
+                return values[i]
 
-    high_level_exit = kd_death_cross & (df["K"] > 70)
+            op, args = self.nodes[i]
+            if op == "col":
+                v = c[args[0]]
+            elif op == "ref":
+                v = results[args[0]]
+            elif op == "const":
+                v = args[0]
+            elif op == "and":
+                v = value(args[0])
+                for arg in args[1:]:
+                    v = v & value(arg)
+            elif op == "or":
+                v = value(args[0])
+                for arg in args[1:]:
+                    v = v | value(arg)
+            elif op == "not":
+                v = ~value(args[0])
+            elif op == "neg":
+                v = -value(args[0])
+            else:
+                v = OPERATORS[op](value(args[0]), value(args[1]))
 
-    exit_price = df["close"] < df["MA20"]
-    exit_macd = (df["DIF"] < df["MACD"]) & (df["MACD_hist"] < 0)
+            values[i] = v
+            return v
 
-    df["exit_trend"] = (
-        (exit_price | exit_macd | high_level_exit) &
-        exit_allowed
-    )
+        for name, node in self.outputs:
+            t0 = time.perf_counter()
+            if node is None:
+                source, never = self.counters[name]
+                results[name] = counter(name, results[source], never)
+            else:
+                flags = np.asarray(value(node))
+                if flags.dtype != bool:
+                    raise ValueError(f"signal {name!r} is not a boolean expression")
+                results[name] = flags
+            if timings is not None:
+                timings[name] = time.perf_counter() - t0
+
+        return results
+
+
+RULES = RuleSet.load()
+
+
+# =========================
+# Signal codes
+# =========================
+# Every signal is one bit of `signal_code`, in rule order; signal_today is
+# looked up from the label bits instead of being built row by row.
+SIGNAL_BITS = RULES.signals
+LABEL_SIGNALS = RULES.labels
+
+def code_dtype(n_bits):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_bits <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"too many signals for one code: {n_bits}")
+
+SIGNAL_CODE_DTYPE = code_dtype(len(SIGNAL_BITS))
+
+def signal_label(label_code):
+    labels = [label for bit, (_, label) in enumerate(LABEL_SIGNALS) if label_code >> bit & 1]
+    return "+".join(labels) if labels else "none"
+
+LABELS = np.array([signal_label(code) for code in range(1 << len(LABEL_SIGNALS))], dtype=object)
+
+def signal_codes(signals):
+    code = np.zeros(len(signals[SIGNAL_BITS[0]]), dtype=SIGNAL_CODE_DTYPE)
+    for bit, col in enumerate(SIGNAL_BITS):
+        code |= np.asarray(signals[col], dtype=bool).astype(SIGNAL_CODE_DTYPE) << SIGNAL_CODE_DTYPE(bit)
+    return code
+
+def has_signal(codes, col):
+    """Rows of `codes` where signal `col` is set."""
+    return (np.asarray(codes) >> SIGNAL_BITS.index(col) & 1).astype(bool)
+
+def signal_labels(codes):
+    label_code = np.zeros(len(codes), dtype=np.int64)
+    for bit, (col, _) in enumerate(LABEL_SIGNALS):
+        label_code |= has_signal(codes, col).astype(np.int64) << bit
+    return LABELS[label_code]
+
+def signal_name(name):
+    """Signal column for a signal name or a signal_today word (e.g. "breakout")."""
+    if name in SIGNAL_BITS:
+        return name
+    for col, label in LABEL_SIGNALS:
+        if label == name:
+            return col
+    raise ValueError(f"unknown signal: {name}")
+
+
+# =========================
+# Signals
+# =========================
+def bars_since(flags, pos, never=None):
+    """Rows since `flags` was last set within each stock.
+
+    Before a stock's first flag this is `never`, or the row's position in the
+    stock when `never` is None.
+    """
+    idx = np.arange(len(flags))
+    last = np.maximum.accumulate(np.where(flags, idx, -1))
+    start = idx - pos
+    if never is None:
+        return idx - np.maximum(last, start)
+    return np.where(last >= start, idx - last, never)
+
+
+def calculate_signals(df: pd.DataFrame, rules=RULES, timings=None) -> pd.DataFrame:
+    """Add the signal columns to a multi-stock frame sorted by stock_id / date."""
+    pos = segment_positions(df["stock_id"].to_numpy())
+
+    c = {col: df[col].to_numpy() for col in rules.columns}
+    for col in rules.prev_columns:
+        c[f"prev_{col}"] = group_shift(df[col].to_numpy(dtype=np.float64), pos, 1)
+
+    signals = rules.evaluate(c, lambda name, flags, never: bars_since(flags, pos, never), timings)
+    for name in rules.output_names:
+        df[name] = signals[name]
 
     # =========================
     # Signal labeling
     # =========================
-    df["signal_today"] = df.apply(get_signal_label, axis=1)
+    df["signal_code"] = signal_codes(signals)
+    df["signal_today"] = signal_labels(df["signal_code"].to_numpy())
 
     return df
+
+
+# =========================
+# Rule report
+# =========================
+def report(rules_file=RULES_FILE, daily_file=DAILY_FILE, repeat=3):
+    """Evaluate a rules file on the built daily table and print per-rule timing and hit counts."""
+    rules = RuleSet.load(rules_file)
+    columns = {"stock_id", "date"} | rules.columns | rules.prev_columns
+    df = read_daily(daily_file, sorted(columns))
+
+    runs = []
+    for _ in range(repeat):
+        timings = {}
+        out = calculate_signals(df.copy(), rules, timings)
+        runs.append(timings)
+
+    print(f"{len(df)} rows, {len(rules.nodes)} unique sub-expressions for {rules.references} references")
+    print(f"{'rule':>22} {'ms':>8} {'rows':>10}")
+    for name in rules.output_names:
+        ms = min(t[name] for t in runs) * 1000
+        rows = int(out[name].sum()) if name in rules.signals else "-"
+        print(f"{name:>22} {ms:>8.2f} {rows:>10}")
+    print(f"{'total':>22} {min(sum(t.values()) for t in runs) * 1000:>8.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check a strategy rules file against the built daily table.")
+    parser.add_argument("--rules", default=RULES_FILE, help="rules JSON file")
+    parser.add_argument("--daily", default=DAILY_FILE, help="daily.parquet to evaluate on")
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report(args.rules, args.daily, args.repeat)
@@ -0,0 +1,177 @@
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import query_data
+
+# =========================
+# Config
+# =========================
+HOST = "127.0.0.1"
+PORT = 8765
+N_STOCKS = 1200
+LATENCY_SEC = 0.3
+ERROR_RATE = 0.0
+
+QUOTE_FIELDS = [
+    "證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額",
+    "開盤價", "最高價", "最低價", "收盤價", "漲跌(+/-)", "漲跌價差",
+    "最後揭示買價", "最後揭示買量", "最後揭示賣價", "最後揭示賣量", "本益比",
+]
+
+
+# =========================
+# Fake MI_INDEX payload
+# =========================
+def stock_codes(n):
+    etfs = [f"00{50 + i}" for i in range(min(n // 20, 40))]
+    stocks = [f"{1101 + i}" for i in range(n - len(etfs))]
+    return etfs + stocks
+
+
+def fake_mi_index(date_str, n_stocks=N_STOCKS):
+    date = datetime.strptime(date_str, "%Y%m%d")
+    if date.weekday() >= 5:
+        return {"stat": "很抱歉，沒有符合條件的資料!", "tables": [{}, {}, {}]}
+
+    roc_date = f"{date.year - 1911}年{date.month:02d}月{date.day:02d}日"
+    rng = random.Random(date_str)
+
+    rows = []
+    for i, code in enumerate(stock_codes(n_stocks)):
+        base = 20 + (i % 500)
+        close = round(base * (1 + rng.uniform(-0.05, 0.05)), 2)
+        high = round(close * (1 + rng.uniform(0, 0.03)), 2)
+        low = round(close * (1 - rng.uniform(0, 0.03)), 2)
+        open_ = round(rng.uniform(low, high), 2)
+        volume = rng.randint(1_000, 50_000_000)
+        sign = '<p style= color:red>+</p>' if rng.random() > 0.5 else '<p style= color:green>-</p>'
+        rows.append([
+            code, f"股票{code}", f"{volume:,}", f"{volume // 1000:,}", f"{volume * close:,.0f}",
+            f"{open_:,.2f}", f"{high:,.2f}", f"{low:,.2f}", f"{close:,.2f}", sign, "0.50",
+            f"{close:,.2f}", "10", f"{close:,.2f}", "10", "12.34",
+        ])
+
+    return {
+        "stat": "OK",
+        "date": date_str,
+        "tables": [
+            {
+                "title": f"{roc_date} 價格指數(臺灣證券交易所)",
+                "fields": ["指數", "收盤指數", "漲跌(+/-)", "漲跌點數", "漲跌百分比(%)"],
+                "data": [["發行量加權股價指數", "17,000.00", "+", "10.00", "0.06"]],
+            },
+            {
+                "title": f"{roc_date} 每日收盤行情(全部)",
+                "fields": QUOTE_FIELDS,
+                "data": rows,
+            },
+        ],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = LATENCY_SEC
+    n_stocks = N_STOCKS
+    error_rate = ERROR_RATE
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        date_str = parse_qs(url.query).get("date", [""])[0]
+
+        try:
+            datetime.strptime(date_str, "%Y%m%d")
+        except ValueError:
+            self.send_error(400, "bad date")
+            return
+
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.send_error(503, "stub overload")
+            return
+
+        body = json.dumps(fake_mi_index(date_str, self.n_stocks), ensure_ascii=False).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=HOST, port=PORT, latency=LATENCY_SEC, n_stocks=N_STOCKS, error_rate=ERROR_RATE):
+    attrs = {"latency": latency, "n_stocks": n_stocks, "error_rate": error_rate}
+    handler = type("Handler", (StubHandler,), attrs)
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# =========================
+# Throughput benchmark
+# =========================
+def bench(start_date, end_date, workers_list, rate, burst, server):
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}/exchangeReport/MI_INDEX"
+    n_days = (end_date - start_date).days + 1
+
+    print(f"{'workers':>8} {'seconds':>8} {'days/s':>8}")
+    for workers in workers_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            t0 = time.perf_counter()
+            query_data.main(
+                start_date=start_date,
+                end_date=end_date,
+                workers=workers,
+                rate=rate,
+                burst=burst,
+                base_url=base_url,
+                base_dir=tmp,
+            )
+            elapsed = time.perf_counter() - t0
+        print(f"{workers:>8} {elapsed:>8.2f} {n_days / elapsed:>8.2f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the TWSE MI_INDEX endpoint.")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY_SEC, help="seconds per response")
+    parser.add_argument("--stocks", type=int, default=N_STOCKS)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fraction of requests answered with 503")
+    parser.add_argument("--bench", action="store_true", help="run query_data against the stub and report throughput")
+    parser.add_argument("--start", default="20240101")
+    parser.add_argument("--end", default="20240131")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second during the benchmark")
+    parser.add_argument("--burst", type=int, default=8)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = start_server(port=args.port, latency=args.latency, n_stocks=args.stocks, error_rate=args.error_rate)
+
+    if args.bench:
+        bench(
+            datetime.strptime(args.start, "%Y%m%d"),
+            datetime.strptime(args.end, "%Y%m%d"),
+            [int(w) for w in args.workers.split(",")],
+            args.rate,
+            args.burst,
+            server,
+        )
+        server.shutdown()
+    else:
+        print(f"Serving fake MI_INDEX on http://{HOST}:{args.port}/exchangeReport/MI_INDEX")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
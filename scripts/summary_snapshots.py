@@ -0,0 +1,200 @@
+import math
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from chart_data import open_arrow, write_arrow
+
+# =========================
+# Config
+# =========================
+SNAPSHOT_FILE = Path("data/processed/summary_snapshots.arrow")
+SNAPSHOT_INDEX_FILE = Path("data/processed/summary_snapshots.npz")
+
+# the summary table's columns
+SUMMARY_COLUMNS = [
+    "stock_id", "stock_name", "close", "close_change_pct", "close_3d_change_pct",
+    "volume", "volume_ratio_5d", "signal_today", "bars_since_entry", "K", "DIF",
+]
+
+# dates whose rows are kept in memory, and pages kept ready to send
+SNAPSHOT_CACHE_SIZE = 32
+PAGE_CACHE_SIZE = 256
+
+# DataTable filter_query operators (without their s / i case prefix)
+FILTER_OPERATORS = {
+    "=": "eq", "eq": "eq",
+    "!=": "ne", "ne": "ne",
+    "<": "lt", "lt": "lt",
+    "<=": "le", "le": "le",
+    ">": "gt", "gt": "gt",
+    ">=": "ge", "ge": "ge",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+FILTER_PART = re.compile(
+    r"^\{(?P<column>[^}]+)\}\s*(?P<case>[si]?)(?P<op>>=|<=|!=|=|<|>|eq|ne|lt|le|gt|ge|contains|datestartswith)\s*(?P<value>.*)$"
+)
+FILTER_BLANK = re.compile(r"^\{(?P<column>[^}]+)\}\s*is (?P<negate>not )?(?:blank|nil)$")
+
+
+# =========================
+# Summary snapshots
+# =========================
+class SummarySnapshots:
+    """The summary table of every trading day.
+
+    Rows are ordered by (date, stock_id) and hold only SUMMARY_COLUMNS, so one
+    day is the slice offsets[i]:offsets[i + 1] for dates[i]. The table is a
+    memory-mapped Arrow file; only the days that are looked at are converted
+    to pandas, and those frames and the pages page() returns are kept in LRU
+    caches.
+    """
+
+    def __init__(self, table, dates, offsets):
+        self.table = table
+        self.dates = dates
+        self.offsets = offsets
+        self._frame = lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)(self._day_frame)
+        self._page = lru_cache(maxsize=PAGE_CACHE_SIZE)(self._day_page)
+
+    # ---------- construction ----------
+    @classmethod
+    def from_daily(cls, daily: pd.DataFrame):
+        table = (
+            daily[["date", *SUMMARY_COLUMNS]]
+            .sort_values(["date", "stock_id"], kind="stable")
+            .reset_index(drop=True)
+        )
+        dates, starts = np.unique(table["date"].to_numpy(dtype="datetime64[ns]"), return_index=True)
+        table = pa.Table.from_pandas(table.drop(columns="date"), preserve_index=False)
+        return cls(table, dates, np.r_[starts, len(table)])
+
+    def extend(self, new_rows: pd.DataFrame):
+        """Snapshots with the days of `new_rows` (all after the last saved day) appended."""
+        added = SummarySnapshots.from_daily(new_rows)
+        table = pa.concat_tables([self.table, added.table.cast(self.table.schema)]).combine_chunks()
+        return SummarySnapshots(table, np.r_[self.dates, added.dates], np.r_[self.offsets[:-1], added.offsets + self.offsets[-1]])
+
+    @classmethod
+    def load(cls, path=SNAPSHOT_FILE, index_path=SNAPSHOT_INDEX_FILE):
+        table = open_arrow(path)
+        with np.load(index_path, allow_pickle=False) as f:
+            dates, offsets = f["dates"], f["offsets"]
+        if table.column_names != SUMMARY_COLUMNS or offsets[-1] != table.num_rows:
+            raise ValueError(f"{path} does not match {index_path}")
+        return cls(table, dates, offsets)
+
+    def save(self, path=SNAPSHOT_FILE, index_path=SNAPSHOT_INDEX_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = write_arrow(self.table, path)
+        tmp_index = Path(index_path).with_suffix(".tmp.npz")
+        with open(tmp_index, "wb") as f:
+            np.savez(f, dates=self.dates, offsets=self.offsets)
+
+        os.replace(tmp, path)
+        os.replace(tmp_index, index_path)
+
+    # ---------- lookups ----------
+    def date_index(self, date):
+        date = np.datetime64(pd.Timestamp(date), "ns")
+        i = np.searchsorted(self.dates, date)
+        if i == len(self.dates) or self.dates[i] != date:
+            raise KeyError(f"no summary for {date}")
+        return int(i)
+
+    def frame(self, date):
+        return self._frame(self.date_index(date))
+
+    def page(self, date, page_current=0, page_size=20, sort_by=None, filter_query=""):
+        """One DataTable page of a date's summary, filtered and sorted: (records, page_count)."""
+        sort_key = tuple((s["column_id"], s["direction"]) for s in sort_by or ())
+        return self._page(self.date_index(date), page_current or 0, page_size, sort_key, filter_query or "")
+
+    def _day_frame(self, i):
+        return self.table.slice(self.offsets[i], self.offsets[i + 1] - self.offsets[i]).to_pandas()
+
+    def _day_page(self, i, page_current, page_size, sort_key, filter_query):
+        frame = self._frame(i)
+        frame = frame[filter_mask(frame, filter_query)]
+        if sort_key:
+            frame = frame.sort_values(
+                [col for col, _ in sort_key],
+                ascending=[direction == "asc" for _, direction in sort_key],
+                kind="stable",
+                na_position="last",
+            )
+
+        page_count = max(1, math.ceil(len(frame) / page_size))
+        first = min(page_current, page_count - 1) * page_size
+        return frame.iloc[first:first + page_size].to_dict("records"), page_count
+
+
+# =========================
+# DataTable filters
+# =========================
+def filter_value(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'`":
+        return text[1:-1]
+    return text
+
+def filter_part_mask(frame, part):
+    """Rows matching one `{column} op value` term; None when the term cannot be applied."""
+    blank = FILTER_BLANK.match(part)
+    if blank:
+        if blank["column"] not in frame:
+            return None
+        values = frame[blank["column"]]
+        mask = (values.isna() | (values.astype(str).str.strip() == "")).to_numpy()
+        return ~mask if blank["negate"] else mask
+
+    m = FILTER_PART.match(part)
+    if m is None or m["column"] not in frame:
+        return None
+    values = frame[m["column"]]
+    op = FILTER_OPERATORS[m["op"]]
+    value = filter_value(m["value"])
+
+    if op in ("contains", "datestartswith"):
+        text = values.astype(str)
+        if m["case"] == "i":
+            text, value = text.str.lower(), value.lower()
+        found = text.str.contains(value, regex=False) if op == "contains" else text.str.startswith(value)
+        return found.to_numpy() & values.notna().to_numpy()
+
+    if pd.api.types.is_numeric_dtype(values):
+        try:
+            value = float(value)
+        except ValueError:
+            return np.zeros(len(frame), dtype=bool)
+    elif m["case"] == "i":
+        values, value = values.str.lower(), value.lower()
+    return getattr(values, op)(value).to_numpy()
+
+def filter_mask(frame, filter_query):
+    """Rows matching a DataTable filter_query (terms joined by &&); terms that do not parse are ignored."""
+    mask = np.ones(len(frame), dtype=bool)
+    for part in filter_query.split("&&"):
+        part = part.strip()
+        if part:
+            part_mask = filter_part_mask(frame, part)
+            if part_mask is not None:
+                mask &= part_mask
+    return mask
+
+
+def load_snapshots(daily_file=None, path=SNAPSHOT_FILE, index_path=SNAPSHOT_INDEX_FILE):
+    """The saved snapshots, or ones built from `daily_file` when the files are missing or stale."""
+    try:
+        return SummarySnapshots.load(path, index_path)
+    except (FileNotFoundError, ValueError) as e:
+        if daily_file is None:
+            raise
+        print(f"Building summary snapshots in memory ({e})")
+        return SummarySnapshots.from_daily(pd.read_parquet(daily_file, columns=["date", *SUMMARY_COLUMNS]))
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import backtest
+from indicators import (
+    KD_N, MACD_FAST, MACD_SLOW, MACD_SIGNAL,
+    segment_positions, segment_ids, group_shift, kd_columns, macd_columns,
+)
+from strategy import RULES_FILE, RuleSet, bars_since
+
+# =========================
+# Config
+# =========================
+DAILY_FILE = Path("data/processed/daily.parquet")
+CACHE_ROOT = Path("data/processed/sweep_cache")
+OUT_FILE = Path("data/processed/sweep_results.csv")
+
+SWEEP_WORKERS = os.cpu_count() or 1
+RANK_BY = "sharpe"
+
+# parameters that change indicator columns; everything else is a rule param
+# from the rules file
+INDICATOR_PARAMS = {"kd_n": KD_N, "macd_fast": MACD_FAST, "macd_slow": MACD_SLOW, "macd_signal": MACD_SIGNAL}
+KD_COLUMNS = ("K", "D")
+MACD_COLUMNS = ("DIF", "MACD", "MACD_hist")
+
+DEFAULT_GRID = {
+    "kd_n": [9, 14],
+    "k_overbought": [75, 80, 85],
+    "kd_gap_max": [2, 3, 5],
+    "emergency_ratio": [0.95, 0.97],
+    "min_hold_bars": [2, 3, 5],
+}
+
+
+# =========================
+# Column cache
+# =========================
+# Every array a run needs is an .npy file under one cache folder per
+# daily.parquet version. Workers open them with mmap_mode="r", so the OS
+# page cache holds a single copy that all processes read; only parameter
+# dicts and result rows cross process boundaries. Columns that do not depend
+# on the swept parameters (close, MA10, ...) are written once, K / D once per
+# KD period and DIF / MACD / MACD_hist once per MACD setting.
+
+def short_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+def cache_dir_for(daily_file):
+    """<daily file key>-<version key>: the version is the size and mtime of every file of the table."""
+    path = Path(daily_file).resolve()
+    files = sorted(path.glob("*.parquet")) if path.is_dir() else [path]
+    version = ";".join(f"{f.name}:{f.stat().st_size}:{f.stat().st_mtime_ns}" for f in files)
+    return CACHE_ROOT / f"{short_hash(str(path))}-{short_hash(version)}"
+
+def stale_cache_dirs(cache_dir):
+    """Caches of older versions of the same daily file; other files' caches are left alone."""
+    path_key = cache_dir.name.split("-")[0]
+    return [d for d in CACHE_ROOT.glob(f"{path_key}-*") if d != cache_dir]
+
+def kd_key(n):
+    return f"kd{n}"
+
+def macd_key(fast, slow, signal):
+    return f"macd{fast}_{slow}_{signal}"
+
+def variant_cached(cache_dir, kind, args):
+    if kind == "kd":
+        return (cache_dir / f"{KD_COLUMNS[-1]}_{kd_key(*args)}.npy").exists()
+    return (cache_dir / f"{MACD_COLUMNS[-1]}_{macd_key(*args)}.npy").exists()
+
+def save_array(cache_dir, name, values):
+    tmp = cache_dir / f"{name}.tmp.npy"
+    np.save(tmp, values)
+    os.replace(tmp, cache_dir / f"{name}.npy")
+
+def prepare_base(daily_file, cache_dir, columns):
+    """Write the columns that do not depend on swept parameters; reuse them if already cached."""
+    values = sorted({"low", "high", "close"} | set(columns))
+    if all((cache_dir / f"{name}.npy").exists() for name in ["pos", "date_codes", *values]):
+        return
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    read = ["stock_id", "date", *values]
+    df = pd.read_parquet(daily_file, columns=read).sort_values(["stock_id", "date"], kind="stable")
+
+    pos = segment_positions(df["stock_id"].to_numpy())
+    save_array(cache_dir, "pos", pos)
+    save_array(cache_dir, "date_codes", np.unique(df["date"].to_numpy(), return_inverse=True)[1])
+    for col in values:
+        save_array(cache_dir, col, df[col].to_numpy(dtype=np.float64))
+
+def build_variant(task):
+    """Pool task: compute one KD period or MACD setting and cache its columns."""
+    cache_dir, kind, args = task
+    pos = open_array(cache_dir, "pos")
+    groups = segment_ids(pos)
+    close = np.asarray(open_array(cache_dir, "close"))
+
+    if kind == "kd":
+        (n,) = args
+        k, d, _ = kd_columns(np.asarray(open_array(cache_dir, "low")), np.asarray(open_array(cache_dir, "high")), close, pos, groups, n)
+        for name, values in zip(KD_COLUMNS, (k, d)):
+            save_array(cache_dir, f"{name}_{kd_key(n)}", values)
+    else:
+        dif, macd, hist, _ = macd_columns(close, groups, *args)
+        for name, values in zip(MACD_COLUMNS, (dif, macd, hist)):
+            save_array(cache_dir, f"{name}_{macd_key(*args)}", values)
+    return kind, args
+
+ARRAYS = {}
+
+def open_array(cache_dir, name):
+    """Memory-mapped cached column, opened once per process."""
+    key = (str(cache_dir), name)
+    if key not in ARRAYS:
+        ARRAYS[key] = np.load(Path(cache_dir) / f"{name}.npy", mmap_mode="r")
+    return ARRAYS[key]
+
+
+# =========================
+# One run
+# =========================
+def split_params(params):
+    indicator = {**INDICATOR_PARAMS, **{k: v for k, v in params.items() if k in INDICATOR_PARAMS}}
+    rule = {k: v for k, v in params.items() if k not in INDICATOR_PARAMS}
+    return indicator, rule
+
+def run_one(task):
+    """Pool task: evaluate the rules with one parameter set and backtest them."""
+    cache_dir, rules_spec, params, entry, exits = task
+    t0 = time.perf_counter()
+    indicator, rule_params = split_params(params)
+    rules = RuleSet(rules_spec, rule_params)
+
+    pos = open_array(cache_dir, "pos")
+    kd = kd_key(indicator["kd_n"])
+    macd = macd_key(indicator["macd_fast"], indicator["macd_slow"], indicator["macd_signal"])
+
+    def column(name):
+        if name in KD_COLUMNS:
+            return open_array(cache_dir, f"{name}_{kd}")
+        if name in MACD_COLUMNS:
+            return open_array(cache_dir, f"{name}_{macd}")
+        return open_array(cache_dir, name)
+
+    c = {col: column(col) for col in rules.columns}
+    for col in rules.prev_columns:
+        c[f"prev_{col}"] = group_shift(np.asarray(column(col)), pos, 1)
+
+    signals = rules.evaluate(c, lambda name, flags, never: bars_since(flags, pos, never))
+    entry_flags = signals[entry]
+    exit_flags = np.logical_or.reduce([signals[name] for name in exits])
+
+    long = backtest.long_positions(entry_flags, exit_flags, pos)
+    ret = backtest.strategy_returns(np.asarray(open_array(cache_dir, "close")), long, pos)
+    entries, last, closed, trade_ret = backtest.trade_bounds(long, ret, pos)
+    port_ret, _ = backtest.portfolio_returns(ret, long, pos, open_array(cache_dir, "date_codes"))
+
+    result = {**params, **backtest.performance(trade_ret, closed, last - entries, port_ret)}
+    result["seconds"] = time.perf_counter() - t0
+    return result
+
+
+# =========================
+# Sweep
+# =========================
+def expand_grid(grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(zip(names, values))
+        fast = params.get("macd_fast", MACD_FAST)
+        slow = params.get("macd_slow", MACD_SLOW)
+        if fast < slow:
+            yield params
+
+def sweep(grid=DEFAULT_GRID, daily_file=DAILY_FILE, rules_file=RULES_FILE, workers=SWEEP_WORKERS,
+          entry=backtest.ENTRY_SIGNAL, exits=backtest.EXIT_SIGNALS, rank_by=RANK_BY, out_file=OUT_FILE):
+    with open(rules_file, encoding="utf-8") as f:
+        rules_spec = json.load(f)
+    # unknown parameter names fail here, before any work
+    RuleSet(rules_spec, {name: values[0] for name, values in grid.items() if name not in INDICATOR_PARAMS})
+
+    tasks = list(expand_grid(grid))
+    cache_dir = cache_dir_for(daily_file)
+    for stale in stale_cache_dirs(cache_dir):
+        shutil.rmtree(stale, ignore_errors=True)
+
+    base_columns = RuleSet(rules_spec).columns - set(KD_COLUMNS) - set(MACD_COLUMNS)
+    prepare_base(daily_file, cache_dir, base_columns)
+
+    variants = set()
+    for params in tasks:
+        indicator, _ = split_params(params)
+        variants.add(("kd", (indicator["kd_n"],)))
+        variants.add(("macd", (indicator["macd_fast"], indicator["macd_slow"], indicator["macd_signal"])))
+    missing = [(cache_dir, kind, args) for kind, args in sorted(variants) if not variant_cached(cache_dir, kind, args)]
+
+    print(f"{len(tasks)} parameter sets, {len(variants)} indicator variants ({len(missing)} to compute), {workers} workers")
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for kind, args in executor.map(build_variant, missing):
+            print(f"  cached {kind} {args}")
+        run_tasks = [(cache_dir, rules_spec, params, entry, exits) for params in tasks]
+        results = list(executor.map(run_one, run_tasks))
+
+    ranked = (
+        pd.DataFrame(results)
+        .sort_values(rank_by, ascending=False, na_position="last")
+        .reset_index(drop=True)
+    )
+    ranked.insert(0, "rank", np.arange(1, len(ranked) + 1))
+
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    ranked.to_csv(out_file, index=False)
+
+    print(f"Swept {len(ranked)} parameter sets in {time.perf_counter() - t0:.1f} s")
+    print(ranked.head(10).to_string(index=False))
+    print(f"Successfully saved {out_file}")
+    return ranked
+
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parse_grid(items):
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        grid[name] = [parse_value(v) for v in values.split(",")]
+    return grid
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backtest a grid of strategy parameters in parallel.")
+    parser.add_argument("grid", nargs="*", help="name=v1,v2,... (rule params or kd_n / macd_fast / macd_slow / macd_signal); default: built-in grid")
+    parser.add_argument("--daily", default=DAILY_FILE)
+    parser.add_argument("--rules", default=RULES_FILE)
+    parser.add_argument("--workers", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--rank-by", default=RANK_BY, help="result column to sort by (descending)")
+    parser.add_argument("--out", default=OUT_FILE)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sweep(
+        grid=parse_grid(args.grid) if args.grid else DEFAULT_GRID,
+        daily_file=args.daily,
+        rules_file=args.rules,
+        workers=args.workers,
+        rank_by=args.rank_by,
+        out_file=args.out,
+    )
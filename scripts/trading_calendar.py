@@ -0,0 +1,82 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# =========================
+# Config
+# =========================
+CALENDAR_FILE = Path("data/trading_calendar.json")
+
+
+# =========================
+# Trading calendar
+# =========================
+class TradingCalendar:
+    """Known TWSE trading / non-trading days, persisted as JSON.
+
+    Days are "YYYYMMDD" strings. Weekends count as closed unless a response
+    has shown them to be trading days (TWSE occasionally trades on a Saturday).
+    """
+
+    def __init__(self, path=CALENDAR_FILE):
+        self.path = Path(path)
+        self.trading = set()
+        self.closed = set()
+        self._non_trading = None
+
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.trading = set(data.get("trading", []))
+            self.closed = set(data.get("closed", []))
+
+    @staticmethod
+    def is_weekend(date_str):
+        return datetime.strptime(date_str, "%Y%m%d").weekday() >= 5
+
+    def is_closed(self, date_str):
+        """True when the day is known (or assumed, for weekends) to have no trading."""
+        if date_str in self.trading:
+            return False
+        return date_str in self.closed or self.is_weekend(date_str)
+
+    def mark_trading(self, date_str):
+        self.trading.add(date_str)
+        self.closed.discard(date_str)
+        self._non_trading = None
+
+    def mark_closed(self, date_str):
+        if date_str in self.trading:
+            return
+        self.closed.add(date_str)
+        self._non_trading = None
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"trading": sorted(self.trading), "closed": sorted(self.closed)}, f, indent=0)
+        os.replace(tmp, self.path)
+
+    def trading_days(self):
+        return pd.DatetimeIndex(pd.to_datetime(sorted(self.trading), format="%Y%m%d"))
+
+    def non_trading_days(self, start, end):
+        """Calendar days in [start, end] that are not trading days.
+
+        The full list between the first and last known trading day is built once
+        and sliced with a binary search on later calls.
+        """
+        if self._non_trading is None:
+            days = self.trading_days()
+            if days.empty:
+                self._non_trading = pd.DatetimeIndex([])
+            else:
+                self._non_trading = pd.date_range(days[0], days[-1]).difference(days)
+
+        lo = self._non_trading.searchsorted(pd.Timestamp(start), side="left")
+        hi = self._non_trading.searchsorted(pd.Timestamp(end), side="right")
+        return self._non_trading[lo:hi]